@@ -21,6 +21,82 @@ parser.add_argument('trained_network_path',
 parser.add_argument('-g', '--gpu',
         type=int, help='Put an ID of GPU.')
 
+parser.add_argument('-c', '--chunk-size',
+        type=int, default=0,
+        help='Save probs of each well in chunks of the given number of '
+             'frames, which can be read frame by frame. '
+             'The whole series is saved at once if 0 (default).')
+
+parser.add_argument('-b', '--batch-size',
+        type=int, default=1024,
+        help='Number of well images predicted at once. The well images of '
+             'several frames are put together up to this number '
+             '(at least those of a frame).')
+
+parser.add_argument('-w', '--workers',
+        type=int, default=4,
+        help='Number of threads decoding and cutting out the original '
+             'images while the network predicts.')
+
+parser.add_argument('-s', '--skip-tolerance',
+        type=float, default=0,
+        help='Reuse the probs of a well for a frame whose well image differs '
+             'from the one last inferred by less than this mean absolute '
+             'difference of the pixel values (0-255), and list the reused '
+             'ones in skip_log.csv. All the well images are inferred if 0 '
+             '(default).')
+
+parser.add_argument('-r', '--resume',
+        action='store_true',
+        help='Infer only the frames not inferred yet by the former runs '
+             'with --resume and append them to the results. The inferred '
+             'frames are kept in probs_store, from which an interrupted run '
+             'also restarts.')
+
+parser.add_argument('-n', '--coarse-step',
+        type=int, default=0,
+        help='Infer every this number of frames first, detect the events on '
+             'the coarse signals, and then infer every frame only around the '
+             'events of each well. The signals of the other frames are '
+             'interpolated from the coarse ones and marked in '
+             'interpolated.npy. Every frame is inferred if 0 (default).')
+
+parser.add_argument('--detect',
+        type=str, nargs='+',
+        choices=['pupariation', 'eclosion', 'pupa-and-eclo', 'death'],
+        help='Events detected on the coarse signals with --coarse-step. '
+             'pupariation for larva and eclosion for adult by default.')
+
+parser.add_argument('--method',
+        type=str, default='max', choices=['max', 'relmax', 'thresholding'],
+        help='Detection method of the events on the coarse signals '
+             '(default: max).')
+
+parser.add_argument('--coef',
+        type=float, default=2,
+        help='Coefficient of the thresholds with --method thresholding, the '
+             'same as in Sapphire (default: 2).')
+
+parser.add_argument('--smoothing',
+        action='store_true',
+        help='Smooth the coarse signals with a gaussian window before the '
+             'detection, as the smoothing of Sapphire.')
+
+parser.add_argument('--window-size',
+        type=float, default=10,
+        help='Size of the gaussian window of --smoothing in frames, which is '
+             'scaled to the coarse signals (default: 10).')
+
+parser.add_argument('--window-sigma',
+        type=float, default=5,
+        help='Sigma of the gaussian window of --smoothing in frames, which is '
+             'scaled to the coarse signals (default: 5).')
+
+parser.add_argument('--margin',
+        type=int,
+        help='Number of frames inferred before and after the coarse interval '
+             'including each event. The coarse step by default.')
+
 args = parser.parse_args()
 
 assert os.path.exists(args.inference_dataset_path),  \
@@ -32,6 +108,22 @@ assert os.path.exists(args.trained_network_path),  \
 inference_dataset_path = args.inference_dataset_path
 trained_network_path = args.trained_network_path
 gpu_id = args.gpu
+chunk_size = args.chunk_size
+batch_size = args.batch_size
+n_workers = args.workers
+resume = args.resume
+skip_tolerance = args.skip_tolerance
+coarse_step = args.coarse_step
+detect_method = args.method
+detect_coef = args.coef
+smoothing = args.smoothing
+margin = coarse_step if args.margin is None else args.margin
+
+assert coarse_step == 0 or not resume,  \
+        '--coarse-step cannot be used with --resume.'
+
+assert coarse_step == 0 or skip_tolerance <= 0,  \
+        '--coarse-step cannot be used with --skip-tolerance.'
 
 # 訓練済みネットワークがあるディレクトリの名前（target_dir）
 target_dir = os.path.basename(os.path.dirname(trained_network_path))
@@ -39,12 +131,49 @@ target_dir = os.path.basename(os.path.dirname(trained_network_path))
 # target_dir があるディレクトリの名前（morpho）
 morpho = os.path.basename(os.path.dirname(os.path.dirname(trained_network_path)))
 
+# 粗い推論で検出するイベント
+if args.detect is not None:
+    detects = args.detect
+elif morpho == 'adult':
+    detects = ['eclosion']
+else:
+    detects = ['pupariation']
+
+# Events detectable on the signals of each morph, as in Sapphire
+morph_detects = {
+        'larva': ['pupariation', 'pupa-and-eclo'],
+        'adult': ['eclosion', 'pupa-and-eclo', 'death']}
+
+if coarse_step > 0:
+    if morpho not in morph_detects:
+        parser.error('--coarse-step needs a network for larva or adult.')
+
+    for detect in detects:
+        if detect not in morph_detects[morpho]:
+            parser.error('{} is not detected with a network for {}.'.format(
+                detect, morpho))
+
+# The gaussian window is scaled from the frames to the coarse signals
+window_size = max(int(round(args.window_size / max(coarse_step, 1))), 1)
+window_sigma = args.window_sigma / max(coarse_step, 1)
+
 # 利用する GPU の ID を設定する
 os.environ['CUDA_VISIBLE_DEVICES'] = str(gpu_id)
 
 import PIL
+import csv
 import json
 import glob
+import shutil
+import itertools
+import collections
+import concurrent.futures
+import my_mask
+import my_cache
+import my_probs
+import my_store
+import my_detect
+import my_labels
 import numpy as np
 from tqdm import tqdm
 
@@ -111,60 +240,243 @@ def zeropadding(img, shape=(100, 100)):
     return result
 
 
-def split(image_path, n_wells, mask):
-    org_image = np.array(PIL.Image.open(image_path).convert('L'), dtype=np.uint8)
-    
-    well_images = []
-    for well_idx in range(n_wells):
-        # Cut out a well image from the original image
-        r, c = np.where(mask == well_idx)
-        well_image = org_image[r.min():r.max(), c.min():c.max()]
-        height, width = well_image.shape
-        well_images.append(well_image)
-        
-    return np.array(well_images)
-
-
-def get_well_imgs(img, mask, n_wells):
+def get_well_imgs(img, boxes, n_wells):
     well_imgs = []
     for i in range(n_wells):
-        rows, clms = np.where(mask == i)
-        well_imgs.append(img[min(rows):max(rows), min(clms):max(clms)])
+        well_imgs.append(my_mask.crop(img, boxes[i]))
     well_imgs = np.array(well_imgs)
 
     return well_imgs.reshape(
             well_imgs.shape[0], well_imgs.shape[1], well_imgs.shape[2], 1)
 
 
-def inference(orgimg_path):
-    # ウェル画像の切り出し
-    well_images = split(orgimg_path, n_wells, mask)
-    
-    # (n_wells, height, width) -> (n_wells, height, width, 1)
-    well_images = np.expand_dims(well_images, axis=-1)
-    
-    # Zeropadding
-    well_images = np.array(
-            [zeropadding(well_image, (56, 56)) for well_image in well_images])
+def preprocess(orgimg_path, out):
+    org_image = np.array(
+            PIL.Image.open(orgimg_path).convert('L'), dtype=np.uint8)
+
+    # ウェル画像の切り出し、Zeropadding とデータの正規化
+    cropper(org_image, out)
+
+
+def predict(well_images):
+    return (100 * model.predict(
+        well_images, batch_size=batch_size)).astype(np.uint8)
+
+
+def inference(orgimg_paths, skip_log=None, targets=None):
+    '''
+    Inference of the frames in batches of several frames.
+
+    The original images are decoded and cut out on a thread pool while
+    the network predicts the former batch, and the results are yielded
+    frame by frame in order. The well images are written into three
+    batches used in turn (one being predicted and two being prepared).
+
+    With skip_tolerance > 0, a well image which hardly differs from the
+    one last sent to the network is not inferred, and the probs of the
+    well are reused. The reused ones are written to skip_log (csv.writer)
+    and counted in skip_counts.
+
+    With targets, only the targeted wells of each frame are inferred and
+    the probs of the others are left zero.
+
+    Input
+    -----
+    orgimg_paths : list of the paths to the original images
+    skip_log : csv.writer or None
+    targets : ndarray (n_frames, n_wells), bool, or None for all the wells
+
+    Output
+    ------
+    probs : generator of ndarray (n_wells, 56, 56, 2), uint8
+    '''
+    frames_per_batch = max(1, batch_size // n_wells)
+    batches = [cropper.new_batch(frames_per_batch) for _ in range(3)]
+
+    def submit(frame_idx, orgimg_path):
+        batch = batches[(frame_idx // frames_per_batch) % len(batches)]
+        start = (frame_idx % frames_per_batch) * n_wells
+        return executor.submit(
+                preprocess, orgimg_path, batch[start:start+n_wells])
+
+    with concurrent.futures.ThreadPoolExecutor(n_workers) as executor:
+        frames = enumerate(orgimg_paths)
+
+        # Keep the preprocessing ahead of the prediction by a batch
+        futures = collections.deque(
+                submit(frame_idx, orgimg_path) for frame_idx, orgimg_path
+                in itertools.islice(frames, 2*frames_per_batch))
+
+        # Well images sent to the network last and their probs
+        references = None
+        reference_names = [None] * n_wells
+        last_probs = None
+
+        batch_idx = 0
+        while len(futures) > 0:
+            n_frames = 0
+            while len(futures) > 0 and n_frames < frames_per_batch:
+                futures.popleft().result()
+                n_frames += 1
+
+                frame = next(frames, None)
+                if frame is not None:
+                    futures.append(submit(*frame))
+
+            batch = batches[batch_idx % len(batches)][:n_frames*n_wells]
+            first_frame = batch_idx * frames_per_batch
+            batch_idx += 1
+
+            if skip_tolerance <= 0 and targets is None:
+                # Inference
+                probs = predict(batch)
+
+                for frame_idx in range(n_frames):
+                    yield probs[frame_idx*n_wells:(frame_idx+1)*n_wells]
+
+                continue
+
+            if targets is not None:
+                sent = targets[first_frame:first_frame+n_frames]
+
+            else:
+                sent = np.ones((n_frames, n_wells), dtype=bool)
+
+            # Select the well images to be inferred frame by frame
+            images = batch.reshape(n_frames, n_wells, -1)
+
+            for frame_idx in range(n_frames if skip_tolerance > 0 else 0):
+                frame_name = os.path.basename(
+                        orgimg_paths[first_frame+frame_idx])
+
+                if references is None:
+                    references = images[frame_idx].copy()
+
+                else:
+                    # Mean absolute difference of the pixel values in the
+                    # wells (the padding does not differ)
+                    diffs = 127.5 * np.abs(
+                            images[frame_idx] - references).sum(axis=1)  \
+                            / cropper.sizes
+                    sent[frame_idx] = diffs >= skip_tolerance
+                    references[sent[frame_idx]] =  \
+                            images[frame_idx, sent[frame_idx]]
+
+                    for well_idx in np.flatnonzero(~sent[frame_idx]):
+                        skip_log.writerow([
+                            frame_name, well_idx, reference_names[well_idx],
+                            '{:.2f}'.format(diffs[well_idx])])
+
+                for well_idx in np.flatnonzero(sent[frame_idx]):
+                    reference_names[well_idx] = frame_name
+
+            if skip_tolerance > 0:
+                skip_counts['inferred'] += int(sent.sum())
+                skip_counts['reused'] += int((~sent).sum())
+
+            # Inference only of the selected ones
+            if sent.any():
+                probs = predict(batch[np.flatnonzero(sent.ravel())])
+            else:
+                probs = last_probs[:0]
+
+            start = 0
+            for frame_idx in range(n_frames):
+                frame_probs = np.zeros(
+                        (n_wells,) + probs.shape[1:], dtype=np.uint8)
+
+                stop = start + sent[frame_idx].sum()
+                frame_probs[sent[frame_idx]] = probs[start:stop]
+                if skip_tolerance > 0 and not sent[frame_idx].all():
+                    frame_probs[~sent[frame_idx]] =  \
+                            last_probs[~sent[frame_idx]]
+                start = stop
+
+                last_probs = frame_probs
+                yield frame_probs
+
+
+def coarse_frames(n_frames, step):
+    # Every step frames and the last frame
+    coarse_idxs = np.arange(0, n_frames, step)
+    if coarse_idxs[-1] != n_frames - 1:
+        coarse_idxs = np.append(coarse_idxs, n_frames - 1)
+
+    return coarse_idxs
 
-    # データの正規化
-    well_images = tf_normalize(well_images)
 
-    # Inference
-    return (100 * model.predict(well_images)).astype(np.uint8)
+def event_windows(auto_evals, coarse_idxs, n_frames):
+    '''
+    Frames to be inferred densely around the events of each well.
+
+    An event at a time of the coarse signals lies between the two coarse
+    frames of the time, which are widened by the margin.
+
+    Input
+    -----
+    auto_evals : list of ndarray (n_wells,), the times of the coarse signals
+    coarse_idxs : ndarray (n_coarse,), the frames of the coarse signals
+
+    Output
+    ------
+    targets : ndarray (n_frames, n_wells), bool
+    '''
+    targets = np.zeros((n_frames, n_wells), dtype=bool)
+
+    for events in auto_evals:
+        # Events not detected are given as the length of the signals
+        events = np.clip(events, 0, len(coarse_idxs) - 2)
+
+        for well_idx, event in enumerate(events):
+            start = max(coarse_idxs[event] - margin, 0)
+            stop = min(coarse_idxs[event+1] + margin + 1, n_frames)
+            targets[start:stop, well_idx] = True
+
+    return targets
+
+
+def interpolate_signals(coarse_signals, coarse_idxs):
+    '''
+    Signals of every frame interpolated from the coarse signals.
+
+    The label difference between two coarse frames is divided among the
+    frames between them in integers whose sum is the same.
+
+    Input
+    -----
+    coarse_signals : ndarray (n_coarse - 1, n_wells), int64
+
+    Output
+    ------
+    signals : ndarray (n_frames - 1, n_wells), int64
+    '''
+    lengths = np.diff(coarse_idxs)
+    intervals = np.repeat(np.arange(len(lengths)), lengths)
+    offsets = np.arange(len(intervals))  \
+            - np.repeat(coarse_idxs[:-1], lengths)
+
+    signals = coarse_signals[intervals]
+    lengths = lengths[intervals, np.newaxis]
+    offsets = offsets[:, np.newaxis]
+
+    return signals * (offsets + 1) // lengths - signals * offsets // lengths
 
 
 # ============
 #  推論
 # ============
-# マスクのロード
-mask = np.load(os.path.join(inference_dataset_path, 'mask.npy'))
+# ウェルの bounding box のロード（mask.npy から作成）
+boxes = my_mask.load_bounding_boxes(inference_dataset_path)
 
 # ウェル数のロード
 with open(os.path.join(inference_dataset_path, 'mask_params.json')) as f:
     params = json.load(f)
 n_wells = params['n-rows'] * params['n-clms'] * params['n-plates']
 
+# Cut out the well images into the batches already normalized
+cropper = my_mask.WellCropper(
+        boxes[:n_wells], (56, 56), tf_normalize(np.arange(256)))
+
 # 訓練済みネットワークのロード
 model = keras.models.load_model(trained_network_path,
         custom_objects={'IoU': IoU, 'TP': TP, 'FP': FP, 'FN': FN, 'TN': TN})
@@ -173,40 +485,175 @@ model = keras.models.load_model(trained_network_path,
 orgimg_paths = sorted(glob.glob(os.path.join(
         glob.escape(inference_dataset_path), 'original', '*.jpg')))
 
-probs = []
-# for each frame
-for orgimg_path in tqdm(orgimg_paths):
-    probs.append(inference(orgimg_path))
-    
 
-# ==============
-#  データの作成
-# ==============
-# Tranform float probs into percentage
-probs = np.array(probs).reshape(len(orgimg_paths), n_wells, 56, 56, 2)
+# ============
+#  出力の準備
+# ============
+out_dir = os.path.join(inference_dataset_path, 'inference', morpho, target_dir)
+os.makedirs(os.path.join(out_dir, 'probs'), exist_ok=True)
 
-# only probs which the animal is in the pixel
-probs = probs[:, :, :, :, 1]
+# Probs are written frame by frame into the store on disk
+store_dir = os.path.join(out_dir, 'probs_store')
+if not resume and os.path.exists(store_dir):
+    shutil.rmtree(store_dir)
+
+# The network is identified by its path, mtime and size, so that a network
+# retrained in the same path is not mixed up
+store = my_store.ProbsStore(store_dir, {
+        'network': list(my_cache.file_key(trained_network_path)),
+        'mask': os.stat(os.path.join(
+            inference_dataset_path, 'mask.npy')).st_mtime_ns,
+        'n_wells': n_wells})
+
+# Frames already inferred must be the first ones
+frame_names = [os.path.basename(path) for path in orgimg_paths]
+assert frame_names[:len(store.frames)] == store.frames,  \
+        'Some of the inferred frames were removed or renamed. '  \
+        'Please run without --resume to start over.'
+
+new_paths = orgimg_paths[len(store.frames):]
+store.open_segment(len(new_paths))
+
+# 推論を省略したウェル画像の記録
+skip_counts = collections.Counter()
+if skip_tolerance > 0:
+    skip_log_path = os.path.join(out_dir, 'skip_log.csv')
+    append_log = resume and os.path.exists(skip_log_path)
+
+    skip_log_file = open(skip_log_path, 'a' if append_log else 'w', newline='')
+    skip_log = csv.writer(skip_log_file)
+    if not append_log:
+        skip_log.writerow(
+                ['Image name', 'Well', 'Reused image name', 'Difference'])
+
+else:
+    skip_log = None
+
+if coarse_step > 0:
+    # 1 回目: 粗いフレームだけを推論し、イベントを検出する
+    coarse_idxs = coarse_frames(len(new_paths), coarse_step)
+    coarse_probs = np.lib.format.open_memmap(
+            os.path.join(store_dir, 'coarse_probs.npy'), mode='w+',
+            dtype=np.uint8,
+            shape=(len(coarse_idxs), n_wells) + my_store.PROB_SHAPE)
+    coarse_signals = np.zeros((len(coarse_idxs) - 1, n_wells), dtype=np.int64)
+
+    prev_labels = None
+    for coarse_idx, frame_probs in enumerate(tqdm(
+            inference([new_paths[idx] for idx in coarse_idxs]),
+            total=len(coarse_idxs))):
+
+        coarse_probs[coarse_idx] = frame_probs[:, :, :, 1]
+
+        labels = my_labels.pack(coarse_probs[coarse_idx])
+        if prev_labels is not None:
+            coarse_signals[coarse_idx-1] = my_labels.count_changes(
+                    labels, prev_labels)
+        prev_labels = labels
+
+    if len(coarse_signals) > 0:
+        auto_evals = []
+        for detect in detects:
+            # Not weighted, which needs the midpoints given in Sapphire
+            signals = my_detect.seasoning(
+                    coarse_signals.T, morpho, detect, window_size,
+                    window_sigma, smoothing, False, None)
+
+            auto_evals.append(my_detect.detect_event(
+                signals, my_detect.THRESH_FUNC(signals, coef=detect_coef),
+                morpho, detect, detect_method))
+
+        targets = event_windows(auto_evals, coarse_idxs, len(new_paths))
+
+    else:
+        targets = np.zeros((len(new_paths), n_wells), dtype=bool)
+
+    # The coarse frames are already inferred
+    targets[coarse_idxs] = False
+    inferred = targets.copy()
+    inferred[coarse_idxs] = True
+
+    # 2 回目: イベント周辺のフレームだけを推論する
+    dense_idxs = np.flatnonzero(targets.any(axis=1))
+    dense_probs = inference(
+            [new_paths[idx] for idx in dense_idxs], targets=targets[dense_idxs])
+
+    print('Inferred {} of {} well images.'.format(
+        int(inferred.sum()), inferred.size))
+
+    # Each well keeps the probs of the frame last inferred
+    frame_probs = np.zeros((n_wells,) + my_store.PROB_SHAPE, dtype=np.uint8)
+    coarse_positions = dict(zip(coarse_idxs, range(len(coarse_idxs))))
+
+    for frame_idx in tqdm(range(len(new_paths))):
+        if frame_idx in coarse_positions:
+            frame_probs[:] = coarse_probs[coarse_positions[frame_idx]]
+
+        elif targets[frame_idx].any():
+            frame_targets = targets[frame_idx]
+            frame_probs[frame_targets] =  \
+                    next(dense_probs)[frame_targets, :, :, 1]
+
+        store.append(os.path.basename(new_paths[frame_idx]), frame_probs)
+
+    del coarse_probs
+
+else:
+    # for each frame
+    for orgimg_path, frame_probs in zip(new_paths, tqdm(
+            inference(new_paths, skip_log), total=len(new_paths))):
 
-# Wells first (wells, org_imgs, height, width)
-probs = probs.transpose(1, 0, 2, 3)
+        # only probs which the animal is in the pixel
+        store.append(os.path.basename(orgimg_path), frame_probs[:, :, :, 1])
+
+store.close()
 
-# シグナルの作成
-signals = (np.diff((probs >= 50).astype(np.int8), axis=1)**2).sum(-1).sum(-1).T
+if skip_tolerance > 0:
+    skip_log_file.close()
+
+    n_images = skip_counts['inferred'] + skip_counts['reused']
+    print('Reused the probs of {} of {} well images ({:.1f}%).'.format(
+        skip_counts['reused'], n_images,
+        100 * skip_counts['reused'] / max(n_images, 1)))
 
 
 # ==============
 #  保存
 # ==============
-out_dir = os.path.join(inference_dataset_path, 'inference', morpho, target_dir)
-os.makedirs(os.path.join(out_dir, 'probs'), exist_ok=True)
-
-# probs の保存
+# probs の保存（ストアからウェルごとに読み出す）
 for well_idx in range(n_wells):
-    np.savez_compressed(os.path.join(
-        out_dir, 'probs', '{:03d}.npz'.format(well_idx)), probs[well_idx])
+    probs_path = os.path.join(out_dir, 'probs', '{:03d}.npz'.format(well_idx))
 
-np.savez_compressed(os.path.join(out_dir, 'probs.npz'), probs)
+    if chunk_size > 0:
+        my_probs.save_chunked(probs_path, store.well_probs(well_idx), chunk_size)
+
+    else:
+        np.savez_compressed(probs_path, store.well_probs(well_idx))
+
+store.save_npz(os.path.join(out_dir, 'probs.npz'))
+
+# ラベルの保存（ビットに詰めたもの）
+store.save_labels(os.path.join(out_dir, 'labels.npy'))
 
 # シグナルの保存
+signals = store.all_signals()
+interpolated_path = os.path.join(out_dir, 'interpolated.npy')
+
+if coarse_step > 0:
+    # Signals between the frames not inferred both are interpolated
+    interpolated = np.logical_not(
+            np.logical_and(inferred[:-1], inferred[1:]))
+    signals[interpolated] =  \
+            interpolate_signals(coarse_signals, coarse_idxs)[interpolated]
+
+    np.save(interpolated_path, interpolated)
+
+elif os.path.exists(interpolated_path):
+    # Left by a former run with --coarse-step
+    os.remove(interpolated_path)
+
 np.save(os.path.join(out_dir, 'signals.npy'), signals)
+
+# Keep the store only to resume later
+if not resume:
+    shutil.rmtree(store_dir)
@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+# vim: set foldmethod=marker commentstring=\ \ #\ %s :
+#
+# Author:    Taishi Matsumura
+# Created:   2026-10-18
+#
+# Copyright (C) 2026 Taishi Matsumura
+#
+import os
+import glob
+import argparse
+import numpy as np
+from tqdm import tqdm
+import my_labels
+import my_probs
+
+
+# =================
+#  Argument parse
+# =================
+parser = argparse.ArgumentParser(
+        description='Make the label difference signals at all the '
+                    'thresholds of the probs (signals_theta.npy).')
+parser.add_argument('inference_path', type=str,
+        help='Put a path to an inference result including probs, '
+             'e.g. dataset/inference/larva/profile1.')
+parser.add_argument('-c', '--chunk-size', type=int, default=256,
+        help='Number of frames of a well processed at once.')
+args = parser.parse_args()
+
+assert os.path.exists(os.path.join(args.inference_path, 'probs')),  \
+        'The given path has no probs.'
+
+inference_path = args.inference_path
+chunk_size = args.chunk_size
+
+
+# ===================
+#  Data preparation
+# ===================
+probs_paths = sorted(glob.glob(os.path.join(
+        glob.escape(inference_path), 'probs', '*.npz')))
+n_wells = len(probs_paths)
+
+with np.load(probs_paths[0]) as npz:
+    n_frames = int(npz['n_frames']) if 'n_frames' in npz.files  \
+            else len(npz['arr_0'])
+
+# Thresholds 0, 1, ..., 100 (probs in percentage)
+n_thetas = my_labels.N_THETAS
+
+out_path = os.path.join(inference_path, my_labels.THETA_SIGNALS)
+signals = np.lib.format.open_memmap(
+        out_path + '.tmp', mode='w+', dtype=np.uint16,
+        shape=(n_thetas, n_frames - 1, n_wells))
+
+
+# ===================
+#  Signals
+# ===================
+for well_idx, probs_path in enumerate(tqdm(probs_paths)):
+    probs = my_probs.load_all(probs_path)
+
+    # The chunks overlap by a frame to make the differences between them
+    for start in range(0, n_frames - 1, chunk_size):
+        stop = min(start + chunk_size, n_frames - 1)
+        signals[:, start:stop, well_idx] = my_labels.theta_signals(
+                probs[start:stop+1], n_thetas)
+
+
+# ===================
+#  Save
+# ===================
+signals.flush()
+del signals
+
+os.replace(out_path + '.tmp', out_path)
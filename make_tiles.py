@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+# vim: set foldmethod=marker commentstring=\ \ #\ %s :
+#
+# Author:    Taishi Matsumura
+# Created:   2026-10-18
+#
+# Copyright (C) 2026 Taishi Matsumura
+#
+import os
+import json
+import glob
+import argparse
+from tqdm import tqdm
+import my_mask
+import my_tiles
+
+
+# =================
+#  Argument parse
+# =================
+parser = argparse.ArgumentParser(
+        description='Cut the original images into well images (tiles.npy).')
+parser.add_argument('dataset_path', type=str, help='Put a path to a dataset.')
+args = parser.parse_args()
+
+assert os.path.exists(args.dataset_path), 'The given path does not exist.'
+assert os.path.exists(os.path.join(args.dataset_path, 'mask.npy')),  \
+        'The dataset has no mask.npy. Please make it with the mask maker.'
+
+dataset_path = args.dataset_path
+
+
+# ===================
+#  Data preparation
+# ===================
+with open(os.path.join(dataset_path, 'mask_params.json')) as f:
+    params = json.load(f)
+n_wells = params['n-rows'] * params['n-clms'] * params['n-plates']
+
+boxes = my_mask.load_bounding_boxes(dataset_path)[:n_wells]
+
+orgimg_paths = sorted(glob.glob(os.path.join(
+        glob.escape(dataset_path), 'original', '*.jpg')))
+
+
+# ===================
+#  Save
+# ===================
+my_tiles.make_tiles(dataset_path, orgimg_paths, boxes, progress=tqdm)
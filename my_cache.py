@@ -0,0 +1,244 @@
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+# vim: set foldmethod=marker commentstring=\ \ #\ %s :
+#
+# Author:    Taishi Matsumura
+# Created:   2026-10-18
+#
+# Copyright (C) 2026 Taishi Matsumura
+#
+import os
+import sys
+import threading
+import collections
+import concurrent.futures
+import numpy as np
+
+
+_MISSING = object()
+
+
+def sizeof(value):
+    '''
+    Rough number of bytes held by a value (arrays, containers of arrays
+    and plain python objects).
+    '''
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+
+    elif isinstance(value, (bytes, bytearray, str)):
+        return len(value)
+
+    elif isinstance(value, dict):
+        return sum(sizeof(v) for v in value.values())
+
+    elif isinstance(value, (list, tuple)):
+        return sum(sizeof(v) for v in value)
+
+    elif hasattr(value, 'nbytes'):
+        return value.nbytes
+
+    else:
+        return sys.getsizeof(value)
+
+
+def file_key(path):
+    '''
+    Key identifying the current contents of a file: (path, mtime, size).
+    '''
+    stat = os.stat(path)
+    return os.path.abspath(path), stat.st_mtime_ns, stat.st_size
+
+
+class LRUCache(object):
+    '''
+    Thread-safe least-recently-used cache bounded by the total number of
+    bytes held by its values.
+
+    Dash runs callbacks in parallel threads, so get_or_load() makes sure
+    that a missing value is loaded only once even if several callbacks ask
+    for it at the same time.
+    '''
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._entries = collections.OrderedDict()
+        self._loading = {}
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._entries
+
+    def keys(self):
+        with self._lock:
+            return list(self._entries.keys())
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key not in self._entries:
+                return default
+
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def put(self, key, value, nbytes=None):
+        if nbytes is None:
+            nbytes = sizeof(value)
+
+        with self._lock:
+            self.discard(key)
+
+            # A value larger than the whole cache is never stored
+            if nbytes > self.max_bytes:
+                return value
+
+            self._entries[key] = (value, nbytes)
+            self.nbytes += nbytes
+
+            # Evict the least recently used values
+            while self.nbytes > self.max_bytes:
+                _, (__, evicted) = self._entries.popitem(last=False)
+                self.nbytes -= evicted
+
+        return value
+
+    def get_or_load(self, key, loader, nbytes=None):
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+
+        with self._lock:
+            key_lock = self._loading.setdefault(key, threading.Lock())
+
+        try:
+            with key_lock:
+                # Another thread may have loaded it while we were waiting
+                value = self.get(key, _MISSING)
+                if value is not _MISSING:
+                    return value
+
+                return self.put(key, loader(), nbytes)
+
+        finally:
+            with self._lock:
+                self._loading.pop(key, None)
+
+    def discard(self, key):
+        with self._lock:
+            if key in self._entries:
+                _, nbytes = self._entries.pop(key)
+                self.nbytes -= nbytes
+
+    def discard_if(self, predicate):
+        with self._lock:
+            for key in [key for key in self._entries if predicate(key)]:
+                self.discard(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+
+class SignalCache(LRUCache):
+    '''
+    Cache of activity signals (*signals.npy) shared by all the callbacks.
+
+    The files store signals frame-major, i.e. (n_frames, n_wells). The
+    cache hands out well-major (n_wells, n_frames), C-contiguous and
+    read-only arrays, so callers must copy them before modifying. Entries
+    are keyed on (path, mtime, size) so that a regenerated file is read
+    again and its stale entry is dropped.
+
+    A file of a family of signals (n_signals, n_frames, n_wells) is also
+    read, one signal of the given index at a time.
+    '''
+    def load(self, path, index=None):
+        key = file_key(path) + (index,)
+
+        # Drop the entries of older versions of the same file
+        self.discard_if(lambda k: k[0] == key[0] and k[1:3] != key[1:3])
+
+        return self.get_or_load(key, lambda: read_signals(path, index))
+
+
+def read_signals(path, index=None):
+    if index is None:
+        signals = np.ascontiguousarray(np.load(path).T)
+
+    else:
+        signals = np.ascontiguousarray(
+                np.load(path, mmap_mode='r')[index].T, dtype=np.int64)
+
+    signals.setflags(write=False)
+
+    return signals
+
+
+class ThreadBuffer(object):
+    '''
+    Work array reused by the calls in the same thread.
+
+    The array grows when a larger one is requested and is never shrunk.
+    Callers must not keep the returned view after they finish with it.
+    '''
+    def __init__(self, dtype):
+        self.dtype = dtype
+        self._local = threading.local()
+
+    def get(self, shape):
+        size = int(np.prod(shape))
+        buff = getattr(self._local, 'array', None)
+
+        if buff is None or buff.size < size:
+            buff = np.empty(size, dtype=self.dtype)
+            self._local.array = buff
+
+        return buff[:size].reshape(shape)
+
+
+class Prefetcher(object):
+    '''
+    Load values into a cache in background threads.
+
+    Keys which are already cached or being loaded are skipped, and
+    requests are dropped while max_pending loads are waiting, so that
+    a user moving quickly does not pile up outdated work.
+    '''
+    def __init__(self, cache, max_workers=2, max_pending=8):
+        self.cache = cache
+        self.max_pending = max_pending
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+                max_workers=max_workers)
+
+    def submit(self, key, loader, nbytes=None):
+        if key in self.cache:
+            return False
+
+        with self._lock:
+            if key in self._pending or len(self._pending) >= self.max_pending:
+                return False
+
+            self._pending.add(key)
+
+        self._executor.submit(self._load, key, loader, nbytes)
+
+        return True
+
+    def _load(self, key, loader, nbytes):
+        try:
+            self.cache.get_or_load(key, loader, nbytes)
+
+        except Exception:
+            # A failed prefetch is loaded again when it is requested
+            pass
+
+        finally:
+            with self._lock:
+                self._pending.discard(key)
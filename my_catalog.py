@@ -0,0 +1,109 @@
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+# vim: set foldmethod=marker commentstring=\ \ #\ %s :
+#
+# Author:    Taishi Matsumura
+# Created:   2026-10-18
+#
+# Copyright (C) 2026 Taishi Matsumura
+#
+import os
+import fnmatch
+import threading
+
+
+class Catalog(object):
+    '''
+    Catalog of the datasets under data_root shared by the callbacks.
+
+    Listing a directory of 20k+ frames on network storage takes hundreds
+    of milliseconds, so each listing (frame paths, inference profiles and
+    signal files) is built once and kept with the mtime of its directory.
+    A query costs only one stat of the directory, and the listing is built
+    again when files are added to, removed from or renamed in it.
+
+    data_root/
+      ├── {dataset}/
+      │     ├── original/*.jpg                     <- frames()
+      │     └── inference/
+      │           ├── {morph}/                      <- profiles()
+      │           │     └── {profile}/*signals.npy  <- signal_files()
+    '''
+    def __init__(self):
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def datasets(self, data_root):
+        return self._lookup('datasets', data_root, _list_names)
+
+    def frames(self, data_root, env):
+        return self._lookup(
+                'frames', os.path.join(data_root, env, 'original'),
+                _list_frames)
+
+    def n_frames(self, data_root, env):
+        return len(self.frames(data_root, env))
+
+    def profiles(self, data_root, env, morph):
+        return self._lookup(
+                'profiles', os.path.join(data_root, env, 'inference', morph),
+                _list_dirs)
+
+    def signal_files(self, data_root, env, morph, profile):
+        return self._lookup(
+                'signals',
+                os.path.join(data_root, env, 'inference', morph, profile),
+                _list_signal_files)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def _lookup(self, kind, path, build):
+        try:
+            mtime = os.stat(path).st_mtime_ns
+        except OSError:
+            return ()
+
+        key = (kind, os.path.abspath(path))
+
+        with self._lock:
+            entry = self._entries.get(key)
+
+        if entry is not None and entry[0] == mtime:
+            return entry[1]
+
+        value = build(path)
+
+        with self._lock:
+            self._entries[key] = (mtime, value)
+
+        return value
+
+
+def _scan(path):
+    # Hidden files are skipped as glob.glob() does
+    with os.scandir(path) as entries:
+        return sorted(
+                (entry for entry in entries if not entry.name.startswith('.')),
+                key=lambda entry: entry.name)
+
+
+def _list_names(path):
+    return tuple(entry.name for entry in _scan(path))
+
+
+def _list_dirs(path):
+    return tuple(entry.name for entry in _scan(path) if entry.is_dir())
+
+
+def _list_frames(path):
+    return tuple(
+            entry.path for entry in _scan(path)
+            if fnmatch.fnmatchcase(entry.name, '*.jpg'))
+
+
+def _list_signal_files(path):
+    return tuple(
+            entry.name for entry in _scan(path)
+            if fnmatch.fnmatchcase(entry.name, '*signals.npy'))
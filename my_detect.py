@@ -0,0 +1,557 @@
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+# vim: set foldmethod=marker commentstring=\ \ #\ %s :
+#
+# Author:    Taishi Matsumura
+# Created:   2026-10-18
+#
+# Copyright (C) 2026 Taishi Matsumura
+#
+import functools
+import numpy as np
+import scipy.signal
+import scipy.ndimage
+import my_cache
+import my_threshold
+
+
+# Function giving the thresholds (n_wells, 1) of the signals for a coef
+THRESH_FUNC = my_threshold.minmax
+
+# Work buffer to weight the signals in seasoning()
+WEIGHT_BUFFER = my_cache.ThreadBuffer(np.float32)
+
+# Length of gaussian windows from which my_filter() convolves with FFT
+FFT_FILTER_SIZE = 64
+
+
+# =========================================
+#  Smoothing signals with gaussian window
+# =========================================
+def my_filter(signals, size=10, sigma=5, dtype=None):
+    '''
+    Smooth the signals of all the wells with a gaussian window at once.
+
+    The rows are convolved along the frames with the same edges as
+    np.convolve(signal, window, mode='same'). Long windows are convolved
+    in the frequency domain.
+
+    Input
+    -----
+    signals : ndarray (n_wells, n_frames)
+    dtype : output dtype, e.g. np.float32. Float64 if None.
+    '''
+    if dtype is None:
+        dtype = np.float64
+
+    window = gaussian_window(size, sigma, dtype)
+
+    # np.convolve() returns the longer one of the two inputs
+    if size > signals.shape[1]:
+        return np.array(
+                [np.convolve(signal, window, mode='same')
+                    for signal in signals]).astype(dtype, copy=False)
+
+    signals = signals.astype(dtype, copy=False)
+
+    if size >= FFT_FILTER_SIZE:
+        return scipy.signal.fftconvolve(
+                signals, window[np.newaxis], mode='same', axes=1).astype(
+                        dtype, copy=False)
+
+    else:
+        # The center of an even window is shifted to the left by origin
+        # to match np.convolve()
+        return scipy.ndimage.convolve1d(
+                signals, window, axis=1, mode='constant',
+                origin=-(1 - size % 2))
+
+
+@functools.lru_cache(maxsize=64)
+def gaussian_window(size, sigma, dtype=np.float64):
+    window = scipy.signal.windows.gaussian(size, sigma).astype(dtype)
+    window.setflags(write=False)
+
+    return window
+
+
+# ===================================
+#  Seasoning and detection of events
+# ===================================
+def seasoning(signals, signal_type, detect, size, sigma, smooth, weight,
+        pupar_times, midpoints=None, weight_style=None):
+    # pupar_times is not used at present. Eclosion was once weighted
+    # by a ramp starting at the pupariation timing of each well.
+
+    # Smooth the signals
+    # (weighting runs in float32, so smooth into float32 directly)
+    if smooth:
+        signals = my_filter(
+                signals, size=size, sigma=sigma,
+                dtype=np.float32 if weight else None)
+
+    else:
+        pass
+
+    # Apply weight to the signals
+    if weight:
+
+        # Detection of pupariation or death: weaken the signals after the
+        # midpoints
+        if (detect, signal_type) in (
+                ('pupariation', 'larva'),
+                ('pupa-and-eclo', 'larva'),
+                ('death', 'adult')):
+            rising = False
+
+        # Detection of eclosion: weaken the signals before the midpoints
+        elif (detect, signal_type) in (
+                ('eclosion', 'adult'),
+                ('pupa-and-eclo', 'adult')):
+            rising = True
+
+        # Not defined
+        else:
+            return signals
+
+        # Signals given by the cache are read-only, so weight a private
+        # copy in place (the smoothed signals are already private).
+        signals = signals.astype(np.float32, copy=not smooth)
+
+        weight_signals(signals, midpoints['midpoint'], weight_style, rising)
+
+    else:
+        pass
+
+    return signals
+
+
+def weight_signals(signals, midpoints, weight_style, rising):
+    '''
+    Multiply the signals by step or ramp weights in place.
+
+    The weights of all the wells are built at once from the midpoints
+    in a float32 buffer, which is reused by the calls in the same thread.
+
+    Input
+    -----
+    signals : ndarray (n_wells, n_frames), float32
+    midpoints : array-like (n_wells,)
+    weight_style : 'step' or 'ramp'
+    rising : bool
+        If True, the weights rise at the midpoints. Otherwise they fall.
+    '''
+    n_wells, length = signals.shape
+    frames = np.arange(length, dtype=np.float32)
+    midpoints = np.asarray(midpoints, dtype=float).reshape(-1, 1)
+
+    weights = WEIGHT_BUFFER.get(signals.shape)
+
+    if weight_style == 'step':
+        if rising:
+            np.greater_equal(frames, midpoints, out=weights)
+        else:
+            np.less(frames, midpoints, out=weights)
+
+    elif weight_style == 'ramp':
+        # The frames over which the weights rise to 1 or fall to 0
+        spans = length - midpoints if rising else midpoints
+
+        # No ramp fits in a well whose midpoint is at the end (or beyond),
+        # and it is weighted by 0 as the step weights do
+        flat = spans[:, 0] <= 0
+        spans = np.where(flat[:, np.newaxis], 1, spans)
+
+        if rising:
+            slopes = 1 / spans
+            intercepts = -midpoints / spans
+        else:
+            slopes = -1 / spans
+            intercepts = 1
+        np.multiply(frames, slopes, out=weights)
+        weights += intercepts
+        weights[flat] = 0
+
+    else:
+        return signals
+
+    signals *= weights
+
+    return signals
+
+
+def max_amplitude(signals):
+    amplitudes = []
+    for signal in signals:
+        if signal.sum() == 0:
+            amplitudes.append(0)
+        else:
+            amplitudes.append(signal.max() - signal[signal > 0].min())
+    return np.argmax(amplitudes), np.max(amplitudes)
+
+
+def calc_threshold(signal, coef=0.5):
+    max = signal.max()
+    min = signal.min()
+    return min + coef * (max - min)
+
+
+def find_rising_up_and_falling_down(signal, thresh):
+    # シグナルに閾値処理をして二値化する
+    icebergs = (signal > thresh).astype(int)
+    
+    # 二値化されたシグナルから立ち上がりと立ち下がりのインデックスを探す
+    diff = np.diff(icebergs)
+    rising_up_idxs = np.where(diff == 1)[0] + 1
+    falling_down_idxs = np.where(diff == -1)[0] + 1
+    
+    # 例外処理
+    # 始めから立ち上がっていた場合、0 を立ち上がりインデックスとして挿入する
+    if icebergs[0] == 1:
+        rising_up_idxs = np.concatenate([np.array([0]), rising_up_idxs])
+        
+    # 最後が立ち上がりのまま終わっていた場合、
+    # シグナルの最終インデックスを立ち下がりインデックスとして挿入する
+    if icebergs[-1] == 1:
+        falling_down_idxs = np.concatenate([falling_down_idxs, np.array([len(icebergs) - 1])])
+    
+    # 立ち上がりと立ち下がりの数は必ず同数になる
+    assert len(rising_up_idxs) == len(falling_down_idxs)
+    
+    return rising_up_idxs, falling_down_idxs
+
+
+def relmax_by_thresh(signal, thresh):
+    # 閾値を切ったシグナルに対して、立ち上がりと立ち下がりを探す
+    rising_up_idxs, falling_down_idxs = find_rising_up_and_falling_down(signal, thresh)
+    
+    # 極大値の計算
+    relmax_args = scipy.signal.argrelmax(signal, order=3)[0]
+    relmax_values = signal[relmax_args]
+    
+    candidate_args = []
+    for rising_up_idx, falling_down_idx in zip(rising_up_idxs, falling_down_idxs):
+        args = []
+        values = []
+        for relmax_arg, relmax_value in zip(relmax_args, relmax_values):
+            if relmax_arg in range(rising_up_idx, falling_down_idx):
+                args.append(relmax_arg)
+                values.append(relmax_value)
+        assert len(args) == len(values)
+        if len(args) == 0:
+            if rising_up_idx == falling_down_idx:
+                candidate_args.append(rising_up_idx)
+            else:
+                candidate_args.append(rising_up_idx + np.argmax(signal[rising_up_idx:falling_down_idx]))
+        elif len(args) == 1:
+            candidate_args.append(args[0])
+        elif len(args) >= 2:
+            candidate_args.append(args[np.argmax(values)])
+    
+    candidate_args = np.array(candidate_args)
+    
+    return relmax_args, candidate_args
+
+
+def relmax_events(signals, signal_type, detect):
+    '''
+    Event timings detected by the relative maxima of all the signals.
+
+    Same results as applying relmax_by_thresh() to each signal, but the
+    segments above the threshold, the relative maxima and the candidates
+    of all the wells are handled at once on the flattened signals.
+    '''
+    n_wells, length = signals.shape
+    flat = signals.ravel()
+
+    # The threshold of calc_threshold(signal, 0.5) for each signal
+    mins = signals.min(axis=1)
+    maxs = signals.max(axis=1)
+    thresholds = mins + 0.5 * (maxs - mins)
+
+    # Rising up and falling down of the signals cut by the thresholds
+    icebergs = np.zeros((n_wells, length + 2), dtype=np.int8)
+    icebergs[:, 1:-1] = signals > thresholds[:, np.newaxis]
+    diff = np.diff(icebergs, axis=1)
+    seg_wells, rising_up_idxs = np.nonzero(diff == 1)
+    _, falling_down_idxs = np.nonzero(diff == -1)
+
+    # Segments lasting until the end fall down at the last index
+    falling_down_idxs[falling_down_idxs == length] = length - 1
+
+    # Positions of the segments in the flattened signals
+    seg_starts = seg_wells * length + rising_up_idxs
+    seg_ends = seg_wells * length + falling_down_idxs
+    seg_lens = seg_ends - seg_starts
+    n_segs = len(seg_starts)
+
+    # Without relative maxima, the candidate is the maximum of the segment
+    # (or the rising up index when the segment is empty)
+    candidates = seg_starts.copy()
+    if n_segs > 0 and seg_lens.sum() > 0:
+        seg_maxs = np.maximum.reduceat(
+                flat, np.stack([seg_starts, seg_ends], axis=1).ravel())[::2]
+        offsets = np.cumsum(seg_lens) - seg_lens
+        seg_ids = np.repeat(np.arange(n_segs), seg_lens)
+        positions = np.repeat(seg_starts - offsets, seg_lens)  \
+                + np.arange(seg_lens.sum())
+        is_max = flat[positions] == seg_maxs[seg_ids]
+        segs, first = np.unique(seg_ids[is_max], return_index=True)
+        candidates[segs] = positions[is_max][first]
+
+    # With relative maxima, the candidate is the largest one in the segment
+    peak_wells, peak_idxs = scipy.signal.argrelmax(signals, axis=1, order=3)
+    peaks = peak_wells * length + peak_idxs
+    peak_segs = np.searchsorted(seg_starts, peaks, side='right') - 1
+    in_seg = peak_segs >= 0
+    in_seg[in_seg] = peaks[in_seg] < seg_ends[peak_segs[in_seg]]
+    peaks = peaks[in_seg]
+    peak_segs = peak_segs[in_seg]
+    if len(peaks) > 0:
+        segs, group_starts = np.unique(peak_segs, return_index=True)
+        peak_maxs = np.maximum.reduceat(flat[peaks], group_starts)
+        is_max = flat[peaks] == np.repeat(
+                peak_maxs, np.diff(np.append(group_starts, len(peaks))))
+        segs, first = np.unique(peak_segs[is_max], return_index=True)
+        candidates[segs] = peaks[is_max][first]
+
+    # Choose the event timing from the candidates of each well
+    values = flat[candidates]
+    candidates = candidates - seg_wells * length
+    n_cands = np.bincount(seg_wells, minlength=n_wells)
+    first_cands = np.cumsum(n_cands) - n_cands
+    cand_starts = first_cands[n_cands > 0]
+    constant = np.all(signals == signals[:, :1], axis=1)
+
+    auto_evals = np.zeros(n_wells, dtype=int)
+    exceptions = np.logical_or(constant, n_cands == 0)
+
+    # Only one candidate
+    single = np.logical_and(n_cands == 1, np.logical_not(constant))
+    auto_evals[single] = candidates[first_cands[single]]
+
+    # Two or more candidates: the largest one if it is dominant enough
+    multi = np.logical_and(n_cands >= 2, np.logical_not(constant))
+    if multi.any():
+        sums = np.zeros(n_wells, dtype=values[:0].sum().dtype)
+        sums[n_cands > 0] = np.add.reduceat(
+                values, cand_starts, dtype=sums.dtype)
+
+        # ndarray.sum() adds many values pairwise. Follow its order so that
+        # the results of floating point signals are exactly the same.
+        for well_idx in np.where(np.logical_and(multi, n_cands >= 8))[0]:
+            sums[well_idx] = values[seg_wells == well_idx].sum()
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            normed = values / sums[seg_wells]
+
+        normed_maxs = np.zeros(n_wells, dtype=normed.dtype)
+        normed_maxs[n_cands > 0] = np.maximum.reduceat(normed, cand_starts)
+
+        value_maxs = np.zeros(n_wells, dtype=values.dtype)
+        value_maxs[n_cands > 0] = np.maximum.reduceat(values, cand_starts)
+        is_max = values == value_maxs[seg_wells]
+        wells, first = np.unique(seg_wells[is_max], return_index=True)
+        largest = np.zeros(n_wells, dtype=int)
+        largest[wells] = candidates[is_max][first]
+
+        dominant = np.logical_and(multi, normed_maxs >= 0.5)
+        auto_evals[dominant] = largest[dominant]
+        exceptions[np.logical_and(multi, np.logical_not(dominant))] = True
+
+    if exceptions.any():
+        auto_evals[exceptions] = exception_event(detect, signal_type, length)
+
+    return auto_evals
+
+
+def exception_event(detect, signal_type, exception_value):
+    if detect == 'pupariation' and signal_type == 'larva':
+        auto_eval = 0
+
+    elif detect == 'pupariation' and signal_type == 'adult':
+        # Never evaluated
+        raise Exception
+
+    elif detect == 'eclosion' and signal_type == 'larva':
+        # Never evaluated
+        raise Exception
+
+    elif detect == 'eclosion' and signal_type == 'adult':
+        auto_eval = 0
+
+    elif detect == 'pupa-and-eclo' and signal_type == 'larva':
+        auto_eval = 0
+
+    elif detect == 'pupa-and-eclo' and signal_type == 'adult':
+        auto_eval = 0
+
+    elif detect == 'death' and signal_type == 'larva':
+        # Never evaluated
+        raise Exception
+
+    elif detect == 'death' and signal_type == 'adult':
+        auto_eval = exception_value
+
+    return auto_eval
+
+
+def detect_event(signals, thresholds, signal_type, detect, method):
+    n_wells, length = signals.shape
+
+    if method == 'relmax':
+        auto_evals = relmax_events(signals, signal_type, detect)
+
+    elif method == 'max':
+        auto_evals = []
+        for signal in signals:
+            if np.all(signal == signal[0]):
+                auto_eval = exception_event(detect, signal_type, length)
+
+            else:
+                auto_eval = signal.argmax()
+
+            auto_evals.append(auto_eval)
+
+        auto_evals = np.array(auto_evals, dtype=int)
+
+    elif method == 'thresholding':
+        if detect == 'pupariation' and signal_type == 'larva':
+            # Detect the falling of the signal
+            # Scan the signal from the right hand side.
+            auto_evals = \
+                    length - (np.fliplr(signals) > thresholds).argmax(axis=1)
+            # If the signal was not more than the threshold.
+            auto_evals[auto_evals == length] = 0
+
+        elif detect == 'pupariation' and signal_type == 'adult':
+            # Never evaluated
+            raise Exception
+
+        elif detect == 'eclosion' and signal_type == 'larva':
+            # Never evaluated
+            raise Exception
+
+        elif detect == 'eclosion' and signal_type == 'adult':
+            # Detect the rising of the signal
+            # Compute event times from signals
+            auto_evals = (signals > thresholds).argmax(axis=1)
+
+        elif detect == 'pupa-and-eclo' and signal_type == 'larva':
+            # Detect the falling of the signal
+            # Scan the signal from the right hand side.
+            auto_evals = \
+                    length - (np.fliplr(signals) > thresholds).argmax(axis=1)
+            # If the signal was not more than the threshold.
+            auto_evals[auto_evals == length] = 0
+
+        elif detect == 'pupa-and-eclo' and signal_type == 'adult':
+            # Detect the rising of the signal
+            # Compute event times from signals
+            auto_evals = (signals > thresholds).argmax(axis=1)
+
+        elif detect == 'death' and signal_type == 'larva':
+            # Never evaluated
+            raise Exception
+
+        elif detect == 'death' and signal_type == 'adult':
+            # Scan the signal from the right hand side.
+            auto_evals = \
+                    length - (np.fliplr(signals) > thresholds).argmax(axis=1)
+
+    return auto_evals
+
+
+def detect_event_sweep(signals, coefs, signal_type, detect,
+        thresh_func=THRESH_FUNC):
+    '''
+    Event timings detected by thresholding for many coefficients at once.
+
+    Gives the same results as calling detect_event(method='thresholding')
+    with thresh_func(signals, coef) for each coef. The first rising up is
+    the first frame where the prefix maximum of a signal exceeds the
+    threshold, and the last falling down is the last frame where the
+    suffix maximum does. Both envelopes are monotonic, so each threshold
+    is found by a binary search.
+
+    Input
+    -----
+    signals : ndarray (n_wells, n_frames)
+    coefs : array-like (n_coefs,)
+    thresh_func : a function of my_threshold, giving the thresholds
+        (n_wells, 1) of the signals for a coef
+
+    Output
+    ------
+    auto_evals : ndarray (n_coefs, n_wells)
+    '''
+    n_wells, length = signals.shape
+    coefs = np.asarray(coefs, dtype=float).reshape(-1, 1)
+
+    # The thresholding functions of my_threshold are affine in the
+    # coefficient, so two calls give the thresholds of all the coefs
+    offsets = thresh_func(signals, coef=0)[:, 0]
+    slopes = thresh_func(signals, coef=1)[:, 0] - offsets
+    thresholds = offsets + coefs * slopes
+
+    if detect in ('pupariation', 'pupa-and-eclo') and signal_type == 'larva':
+        # The last frame above the threshold is searched for
+        envelopes = np.maximum.accumulate(signals[:, ::-1], axis=1)
+        auto_evals = length - count_not_above(envelopes, thresholds)
+        # Same as detect_event(), the signal above the threshold
+        # at the last frame is treated as no event.
+        auto_evals[auto_evals == length] = 0
+
+    elif detect in ('eclosion', 'pupa-and-eclo') and signal_type == 'adult':
+        # The first frame above the threshold is searched for
+        envelopes = np.maximum.accumulate(signals, axis=1)
+        auto_evals = count_not_above(envelopes, thresholds)
+        # If the signal was not more than the threshold.
+        auto_evals[auto_evals == length] = 0
+
+    elif detect == 'death' and signal_type == 'adult':
+        # The last frame above the threshold is searched for
+        envelopes = np.maximum.accumulate(signals[:, ::-1], axis=1)
+        auto_evals = length - count_not_above(envelopes, thresholds)
+        # If the signal was not more than the threshold.
+        auto_evals[auto_evals == 0] = length
+
+    else:
+        # Never evaluated
+        raise Exception
+
+    return auto_evals
+
+
+def count_not_above(envelopes, thresholds):
+    '''
+    Binary search of the thresholds in non-decreasing envelopes, i.e.
+    np.searchsorted(envelope, threshold, side='right') for every pair of
+    a well and a threshold.
+
+    Input
+    -----
+    envelopes : ndarray (n_wells, n_frames)
+    thresholds : ndarray (n_thresholds, n_wells)
+
+    Output
+    ------
+    counts : ndarray (n_thresholds, n_wells)
+    '''
+    n_wells, length = envelopes.shape
+    wells = np.arange(n_wells)
+
+    lower = np.zeros(thresholds.shape, dtype=int)
+    upper = np.full(thresholds.shape, length, dtype=int)
+    for _ in range(int(np.ceil(np.log2(length + 1)))):
+        middle = (lower + upper) // 2
+        not_above = envelopes[wells, np.minimum(middle, length - 1)]  \
+                <= thresholds
+        searching = lower < upper
+        lower = np.where(
+                np.logical_and(searching, not_above), middle + 1, lower)
+        upper = np.where(
+                np.logical_and(searching, np.logical_not(not_above)),
+                middle, upper)
+
+    return lower
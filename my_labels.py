@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+# vim: set foldmethod=marker commentstring=\ \ #\ %s :
+#
+# Author:    Taishi Matsumura
+# Created:   2026-10-18
+#
+# Copyright (C) 2026 Taishi Matsumura
+#
+import numpy as np
+
+
+# Pixels whose prob is this value or more are labeled as the animal
+THETA = 50
+
+# Number of the thresholds of the probs in percentage (0, 1, ..., 100)
+N_THETAS = 101
+
+# Label difference signals at all the thresholds (n_thetas, n_frames,
+# n_wells) made by make_theta_signals.py
+THETA_SIGNALS = 'signals_theta.npy'
+
+# Number of 1s in each byte
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def threshold(probs, theta=THETA):
+    '''
+    Labels of probability maps, the predicate shared by the label images
+    and the label difference signals.
+    '''
+    return probs >= theta
+
+
+def pack(probs, theta=THETA):
+    '''
+    Labels of probability maps packed into bits.
+
+    Input
+    -----
+    probs : ndarray (..., height, width)
+
+    Output
+    ------
+    packed : ndarray (..., ceil(height * width / 8)), uint8
+    '''
+    labels = threshold(probs, theta)
+    return np.packbits(
+            labels.reshape(labels.shape[:-2] + (-1,)), axis=-1)
+
+
+def unpack(packed, shape=(56, 56)):
+    '''
+    Labels (..., height, width), bool, of packed labels.
+    '''
+    labels = np.unpackbits(
+            packed, axis=-1, count=shape[0] * shape[1]).astype(bool)
+
+    return labels.reshape(packed.shape[:-1] + tuple(shape))
+
+
+def count_changes(packed, prev_packed):
+    '''
+    Number of pixels whose label differs between two packed labels, i.e.
+    the label difference signal, by XOR and popcount.
+
+    Output
+    ------
+    counts : ndarray (...,), int64
+    '''
+    return POPCOUNT[np.bitwise_xor(packed, prev_packed)].sum(
+            axis=-1, dtype=np.int64)
+
+
+def theta_signals(probs, n_thetas=N_THETAS):
+    '''
+    Label difference signals of a well at all the thresholds at once.
+
+    The label of a pixel changes between two frames at a threshold theta
+    exactly when min(p_t, p_t+1) < theta <= max(p_t, p_t+1). So the
+    signal at theta is the number of the max values >= theta minus that
+    of the min values >= theta, which are read from the histograms of the
+    min and max values of each frame.
+
+    Input
+    -----
+    probs : ndarray (n_frames, height, width), integers in [0, n_thetas)
+
+    Output
+    ------
+    signals : ndarray (n_thetas, n_frames - 1), int64, the same as
+        count_changes() of the labels at each theta
+    '''
+    probs = probs.reshape(len(probs), -1).astype(np.intp)
+    n_diffs = len(probs) - 1
+
+    lows = np.minimum(probs[:-1], probs[1:])
+    highs = np.maximum(probs[:-1], probs[1:])
+
+    # Histogram of each frame in a row
+    offsets = n_thetas * np.arange(n_diffs)[:, np.newaxis]
+
+    def at_least(values):
+        hists = np.bincount(
+                (values + offsets).ravel(), minlength=n_diffs * n_thetas
+                ).reshape(n_diffs, n_thetas)
+
+        # Number of the values >= each theta
+        return np.cumsum(hists[:, ::-1], axis=1)[:, ::-1]
+
+    return (at_least(highs) - at_least(lows)).T
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+# vim: set foldmethod=marker commentstring=\ \ #\ %s :
+#
+# Author:    Taishi Matsumura
+# Created:   2026-10-18
+#
+# Copyright (C) 2026 Taishi Matsumura
+#
+import os
+import numpy as np
+import scipy.ndimage
+
+
+def bounding_boxes(mask, n_wells=None):
+    '''
+    Bounding boxes of all the wells found in one pass over the mask.
+
+    A box holds the first and the last rows and columns of the pixels of
+    a well, i.e. the min() and max() of np.where(mask == well_idx). Wells
+    without any pixel have -1s.
+
+    Input
+    -----
+    mask : ndarray (height, width), the well index of each pixel or -1
+    n_wells : int, the number of rows of the output (by default the
+        largest well index + 1)
+
+    Output
+    ------
+    boxes : ndarray (n_wells, 4), int32, [row_min, row_max, clm_min, clm_max]
+    '''
+    labels = np.asarray(mask).astype(np.int32) + 1
+    slices = scipy.ndimage.find_objects(labels)
+
+    if n_wells is None:
+        n_wells = len(slices)
+
+    boxes = -np.ones((n_wells, 4), dtype=np.int32)
+    for well_idx, box in enumerate(slices[:n_wells]):
+        if box is None:
+            continue
+
+        rows, clms = box
+        boxes[well_idx] = (rows.start, rows.stop - 1, clms.start, clms.stop - 1)
+
+    return boxes
+
+
+def crop(image, box):
+    '''
+    Cut out a well image in the same way as the former
+
+        r, c = np.where(mask == well_idx)
+        image[r.min():r.max(), c.min():c.max()]
+
+    which leaves out the last row and column of the well.
+    '''
+    row_min, row_max, clm_min, clm_max = box
+    return image[row_min:row_max, clm_min:clm_max]
+
+
+def sub_mask(mask, box, well_idx):
+    '''
+    Pixels of a well in its bounding box (including the last row and
+    column).
+    '''
+    row_min, row_max, clm_min, clm_max = box
+    return mask[row_min:row_max+1, clm_min:clm_max+1] == well_idx
+
+
+def save_bounding_boxes(dataset_path, mask):
+    '''
+    Save the bounding boxes next to mask.npy as mask_boxes.npy.
+    '''
+    boxes = bounding_boxes(mask)
+    np.save(os.path.join(dataset_path, 'mask_boxes.npy'), boxes)
+
+    return boxes
+
+
+def load_bounding_boxes(dataset_path):
+    '''
+    Load the bounding boxes of the wells of a dataset.
+
+    They are computed from mask.npy and saved as mask_boxes.npy when the
+    file is missing or older than mask.npy.
+    '''
+    mask_path = os.path.join(dataset_path, 'mask.npy')
+    boxes_path = os.path.join(dataset_path, 'mask_boxes.npy')
+
+    if os.path.exists(boxes_path) and  \
+            os.stat(boxes_path).st_mtime_ns >= os.stat(mask_path).st_mtime_ns:
+        return np.load(boxes_path)
+
+    mask = np.load(mask_path)
+
+    try:
+        return save_bounding_boxes(dataset_path, mask)
+
+    except OSError:
+        # The dataset directory may be read-only
+        return bounding_boxes(mask)
+
+
+class WellCropper(object):
+    '''
+    Cut out the images of all the wells of a frame into a batch at once.
+
+    Each well image, cut out in the same way as crop(), is put at the
+    center of a slot of the given shape as zeropadding() in inference.py
+    does. The pixels are mapped with a table of the 256 values (e.g.
+    normalized), and the padding has the value for 0. The pixel indices
+    are computed once from the bounding boxes, so a frame is copied by a
+    gather and a scatter without any per-well array.
+
+    Input
+    -----
+    boxes : ndarray (n_wells, 4), bounding boxes of the wells
+    shape : (height, width) of a slot
+    values : ndarray (256,), the value of each pixel value (by default
+        the pixel value itself)
+    '''
+    def __init__(self, boxes, shape=(56, 56), values=None):
+        if values is None:
+            values = np.arange(256)
+
+        self.n_wells = len(boxes)
+        self.shape = tuple(shape)
+        self.values = np.asarray(values, dtype=np.float32)
+
+        src_rows, src_clms, dst_idxs, sizes = [], [], [], []
+        for well_idx, (row_min, row_max, clm_min, clm_max) in enumerate(boxes):
+            height, width = row_max - row_min, clm_max - clm_min
+            assert height < shape[0] and width < shape[1], 'Image is too small.'
+            sizes.append(height * width)
+
+            rows, clms = np.mgrid[0:height, 0:width]
+            src_rows.append((row_min + rows).ravel())
+            src_clms.append((clm_min + clms).ravel())
+
+            r0, c0 = (shape[0] - height) // 2, (shape[1] - width) // 2
+            dst_idxs.append(np.ravel_multi_index(
+                (np.full(rows.size, well_idx), r0 + rows.ravel(),
+                    c0 + clms.ravel()),
+                (self.n_wells,) + self.shape))
+
+        self.src_rows = np.concatenate(src_rows).astype(np.intp)
+        self.src_clms = np.concatenate(src_clms).astype(np.intp)
+        self.dst_idxs = np.concatenate(dst_idxs).astype(np.intp)
+
+        # Number of the pixels of each well image
+        self.sizes = np.array(sizes)
+
+    def new_batch(self, n_frames=1):
+        '''
+        Batch (n_frames * n_wells, height, width, 1), float32, filled with
+        the padding value.
+        '''
+        return np.full(
+                (n_frames * self.n_wells,) + self.shape + (1,),
+                self.values[0], dtype=np.float32)
+
+    def __call__(self, image, out):
+        '''
+        Put the well images of a frame into out, the part of a batch for
+        a frame (n_wells, height, width, 1).
+        '''
+        np.put(out, self.dst_idxs,
+                self.values[image[self.src_rows, self.src_clms]])
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+# vim: set foldmethod=marker commentstring=\ \ #\ %s :
+#
+# Author:    Taishi Matsumura
+# Created:   2026-10-18
+#
+# Copyright (C) 2026 Taishi Matsumura
+#
+import numpy as np
+
+
+# Number of frames compressed together in a chunk
+CHUNK_SIZE = 32
+
+
+def chunk_name(chunk_idx):
+    return 'chunk{:06d}'.format(chunk_idx)
+
+
+def save_chunked(path, probs, chunk_size=CHUNK_SIZE):
+    '''
+    Save the probability maps of a well in chunks of frames.
+
+    Each chunk is a separate member of the npz archive, and np.load()
+    decompresses a member only when it is accessed, so a frame is read
+    without decompressing the whole series.
+
+    Input
+    -----
+    path : str, e.g. probs/000.npz
+    probs : ndarray (n_frames, height, width), uint8
+    chunk_size : int, the number of frames in a chunk
+    '''
+    chunks = {
+            chunk_name(chunk_idx): probs[start:start+chunk_size]
+            for chunk_idx, start in enumerate(
+                range(0, len(probs), chunk_size))}
+
+    np.savez_compressed(
+            path, chunk_size=np.array(chunk_size),
+            n_frames=np.array(len(probs)), **chunks)
+
+
+def is_chunked(path):
+    # Only the list of the members is read
+    with np.load(path) as npz:
+        return 'chunk_size' in npz.files
+
+
+def load_frames(path, times):
+    '''
+    Load the probability maps of a well at the given frames.
+
+    Only the chunks including the frames are decompressed. Files saved
+    in the former format (the whole series as arr_0) are also read.
+
+    Output
+    ------
+    probs : ndarray (len(times), height, width)
+    '''
+    with np.load(path) as npz:
+        if 'chunk_size' not in npz.files:
+            return npz['arr_0'][list(times)]
+
+        chunk_size = int(npz['chunk_size'])
+
+        chunks = {}
+        for time in times:
+            chunk_idx = time // chunk_size
+            if chunk_idx not in chunks:
+                chunks[chunk_idx] = npz[chunk_name(chunk_idx)]
+
+        return np.array(
+                [chunks[time // chunk_size][time % chunk_size]
+                    for time in times])
+
+
+def load_all(path):
+    '''
+    Load the whole series of the probability maps of a well.
+    '''
+    with np.load(path) as npz:
+        if 'chunk_size' not in npz.files:
+            return npz['arr_0']
+
+        chunk_size = int(npz['chunk_size'])
+        n_chunks = -(-int(npz['n_frames']) // chunk_size)
+
+        return np.concatenate(
+                [npz[chunk_name(chunk_idx)] for chunk_idx in range(n_chunks)])
@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+# vim: set foldmethod=marker commentstring=\ \ #\ %s :
+#
+# Author:    Taishi Matsumura
+# Created:   2026-10-18
+#
+# Copyright (C) 2026 Taishi Matsumura
+#
+'''
+Min/max pyramids of signals for drawing long signals quickly.
+
+A pyramid is saved next to its signals as <signals>_pyramid.npz, which
+holds 'length' (the number of frames) and 'min{k}' and 'max{k}' for each
+level k = 1, 2, .... Only the min and max are stored on purpose: they
+are all that the decimated traces and the extrema of the figures need,
+and a mean would not survive the decimation into min/max buckets.
+Sidecars of older versions which also hold 'mean{k}' are still read,
+and the extra arrays are ignored.
+'''
+import os
+import numpy as np
+
+
+# The coarsest level has at most this number of buckets
+MIN_LEVEL_LENGTH = 256
+
+
+def pyramid_path(signals_path):
+    # e.g. signals.npy -> signals_pyramid.npz
+    return os.path.splitext(signals_path)[0] + '_pyramid.npz'
+
+
+def build_pyramid(signals):
+    '''
+    Min/max pyramid of signals.
+
+    Level k (k >= 1) divides the frames into buckets of 2**k frames and
+    holds the min and max of each bucket.
+
+    Input
+    -----
+    signals : ndarray (n_wells, n_frames)
+
+    Output
+    ------
+    levels : list of (mins, maxs), each ndarray
+        (n_wells, ceil(n_frames / 2**k)), for k = 1, 2, ...
+    '''
+    mins = maxs = signals
+
+    levels = []
+    while mins.shape[1] > MIN_LEVEL_LENGTH or len(levels) == 0:
+        if mins.shape[1] <= 1:
+            break
+
+        # Pair the buckets, repeating the last one if odd
+        if mins.shape[1] % 2 == 1:
+            mins = np.concatenate([mins, mins[:, -1:]], axis=1)
+            maxs = np.concatenate([maxs, maxs[:, -1:]], axis=1)
+
+        mins = np.minimum(mins[:, 0::2], mins[:, 1::2])
+        maxs = np.maximum(maxs[:, 0::2], maxs[:, 1::2])
+
+        levels.append((mins, maxs))
+
+    return levels
+
+
+def save_pyramid(path, levels, length):
+    arrays = {'length': np.array(length)}
+    for k, (mins, maxs) in enumerate(levels, 1):
+        arrays['min{}'.format(k)] = mins
+        arrays['max{}'.format(k)] = maxs
+
+    # Write to a temporary file first not to leave a broken one
+    tmp_path = path + '.tmp.npz'
+    np.savez(tmp_path, **arrays)
+    os.replace(tmp_path, path)
+
+
+def load_pyramid(signals_path):
+    '''
+    Load the pyramid of a signals.npy (frame-major as saved).
+
+    It is built and saved next to the signals when it does not exist or
+    is older than the signals.
+    '''
+    path = pyramid_path(signals_path)
+
+    if os.path.exists(path) and  \
+            os.stat(path).st_mtime_ns >= os.stat(signals_path).st_mtime_ns:
+        with np.load(path) as npz:
+            n_levels = len([name for name in npz.files
+                    if name.startswith('min')])
+
+            return [(npz['min{}'.format(k)], npz['max{}'.format(k)])
+                    for k in range(1, n_levels + 1)]
+
+    signals = np.load(signals_path).T
+    levels = build_pyramid(signals)
+
+    try:
+        save_pyramid(path, levels, signals.shape[1])
+
+    except OSError:
+        # The directory may be read-only
+        pass
+
+    return levels
+
+
+def trace(levels, signal, well_idx, xrange=None, n_buckets=800):
+    '''
+    Points of the signal of a well to draw about n_buckets buckets wide.
+
+    The min and max of each bucket are read from the level of the
+    pyramid whose buckets match the shown range (and its neighbors of
+    the same width for panning), and from the coarsest sufficient level
+    outside. The signal itself is read only where the range is narrower
+    than n_buckets frames.
+
+    Input
+    -----
+    levels : pyramid given by build_pyramid()
+    signal : ndarray (n_frames,), the signal of the well
+    xrange : [x0, x1] or None
+
+    Output
+    ------
+    xs, ys : ndarrays
+    '''
+    length = len(signal)
+    if length == 0:
+        return np.arange(0), signal[:0]
+
+    overview_level = level_for(length, n_buckets, len(levels))
+    xs, ys = points(levels, signal, well_idx, overview_level, 0, length)
+
+    if xrange is not None:
+        lo = int(np.clip(np.floor(xrange[0]), 0, length))
+        hi = int(np.clip(np.ceil(xrange[1]) + 1, 0, length))
+        width = hi - lo
+
+        if width > 0:
+            start = max(lo - width, 0)
+            stop = min(hi + width, length)
+
+            outside = (xs < start) | (xs >= stop)
+            detail_xs, detail_ys = points(
+                    levels, signal, well_idx,
+                    level_for(width, n_buckets, len(levels)), start, stop)
+
+            xs = np.concatenate([xs[outside], detail_xs])
+            ys = np.concatenate([ys[outside], detail_ys])
+
+    # Both ends of the signal
+    xs = np.concatenate([[0], xs, [length - 1]])
+    ys = np.concatenate([[signal[0]], ys, [signal[-1]]])
+
+    order = np.argsort(xs, kind='stable')
+    xs, ys = xs[order], ys[order]
+
+    return xs, ys
+
+
+def level_for(width, n_buckets, n_levels):
+    # The finest level dividing the width into at most n_buckets buckets
+    if width <= n_buckets:
+        return 0
+
+    return min(int(np.ceil(np.log2(width / n_buckets))), n_levels)
+
+
+def points(levels, signal, well_idx, level, start, stop):
+    if level == 0:
+        xs = np.arange(start, stop)
+        return xs, signal[start:stop]
+
+    mins, maxs = levels[level - 1]
+
+    bucket = 2**level
+    first = start // bucket
+    last = -(-stop // bucket)
+
+    # The min at the beginning and the max at the middle of each bucket
+    starts = bucket * np.arange(first, last)
+    xs = np.stack([starts, np.minimum(starts + bucket // 2, stop - 1)], axis=1)
+    ys = np.stack(
+            [mins[well_idx, first:last], maxs[well_idx, first:last]], axis=1)
+
+    return xs.ravel(), ys.ravel()
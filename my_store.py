@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+# vim: set foldmethod=marker commentstring=\ \ #\ %s :
+#
+# Author:    Taishi Matsumura
+# Created:   2026-10-18
+#
+# Copyright (C) 2026 Taishi Matsumura
+#
+import os
+import json
+import zipfile
+import numpy as np
+import my_labels
+
+
+# Frames inferred between the checkpoints
+CHECKPOINT_INTERVAL = 100
+
+# Shape of a probability map
+PROB_SHAPE = (56, 56)
+
+# Bytes of the labels of a probability map packed into bits
+PACKED_SIZE = -(-PROB_SHAPE[0] * PROB_SHAPE[1] // 8)
+
+
+class ProbsStore(object):
+    '''
+    Probability maps of all the frames stored on disk as they are
+    inferred, with a checkpoint manifest of the inferred frames.
+
+    Each run appends a segment, memory-mapped files holding the probs
+    (n_wells, n_frames, 56, 56), the bit-packed labels (n_wells, n_frames,
+    392) and the label difference signals (n_frames, n_wells) of the
+    frames of the run. checkpoint.json lists
+    the names of the inferred frames and how many frames of each segment
+    are valid, and is rewritten every CHECKPOINT_INTERVAL frames, so an
+    interrupted run is resumed from the last checkpoint.
+
+    Input
+    -----
+    store_dir : str, e.g. inference/larva/profile1/probs_store
+    params : dict, the parameters of the inference, which must be the same
+        to resume
+    '''
+    def __init__(self, store_dir, params):
+        self.store_dir = store_dir
+        self.manifest_path = os.path.join(store_dir, 'checkpoint.json')
+
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+
+            assert self.manifest['params'] == params,  \
+                    'The inferred frames were made with other parameters. '  \
+                    'Please run without --resume to start over.'
+
+        else:
+            os.makedirs(store_dir, exist_ok=True)
+            self.manifest = {'params': params, 'frames': [], 'segments': []}
+
+        self.n_wells = params['n_wells']
+        self.arrays = None
+
+        # Packed labels of the last frame, from which the next signal is made
+        self.prev_labels = None
+        for segment_idx in reversed(range(len(self.manifest['segments']))):
+            labels = self.segment(segment_idx, 'labels')
+            if labels.shape[1] > 0:
+                self.prev_labels = np.array(labels[:, -1])
+                break
+
+    @property
+    def frames(self):
+        # Names of the inferred frames in order
+        return self.manifest['frames']
+
+    def segment(self, segment_idx, kind):
+        # Valid part of an array of a segment as a read-only memory map
+        segment = self.manifest['segments'][segment_idx]
+        array = np.load(
+                self.segment_path(segment['name'], kind), mmap_mode='r')
+
+        if kind == 'signals':
+            return array[:segment['n_frames']]
+
+        else:
+            return array[:, :segment['n_frames']]
+
+    def segment_path(self, name, kind):
+        return os.path.join(self.store_dir, '{}_{}.npy'.format(name, kind))
+
+    def open_segment(self, n_frames):
+        '''
+        Start a segment for the given number of frames to be appended.
+        '''
+        # Drop the segments without any valid frame
+        self.manifest['segments'] = [
+                segment for segment in self.manifest['segments']
+                if segment['n_frames'] > 0]
+
+        name = '{:06d}'.format(len(self.manifest['segments']))
+
+        shapes = {
+                'probs': (np.uint8, (self.n_wells, n_frames) + PROB_SHAPE),
+                'labels': (np.uint8, (self.n_wells, n_frames, PACKED_SIZE)),
+                'signals': (np.int64, (n_frames, self.n_wells))}
+
+        self.arrays = {
+                kind: np.lib.format.open_memmap(
+                    self.segment_path(name, kind), mode='w+',
+                    dtype=dtype, shape=shape)
+                for kind, (dtype, shape) in shapes.items()}
+
+        self.manifest['segments'].append({'name': name, 'n_frames': 0})
+
+    def append(self, frame_name, frame_probs):
+        '''
+        Append the probs (n_wells, 56, 56) of a frame to the open segment.
+        '''
+        segment = self.manifest['segments'][-1]
+        time = segment['n_frames']
+
+        labels = my_labels.pack(frame_probs)
+
+        self.arrays['probs'][:, time] = frame_probs
+        self.arrays['labels'][:, time] = labels
+
+        # Label difference from the former frame (0 for the first frame)
+        if self.prev_labels is not None:
+            self.arrays['signals'][time] = my_labels.count_changes(
+                    labels, self.prev_labels)
+        self.prev_labels = labels
+
+        segment['n_frames'] += 1
+        self.frames.append(frame_name)
+
+        if segment['n_frames'] % CHECKPOINT_INTERVAL == 0:
+            self.checkpoint()
+
+    def checkpoint(self):
+        # Flush the data before recording them in the manifest
+        if self.arrays is not None:
+            for array in self.arrays.values():
+                array.flush()
+
+        tmp_path = self.manifest_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+
+    def close(self):
+        self.checkpoint()
+        self.arrays = None
+
+    def well_probs(self, well_idx):
+        # (n_frames, 56, 56) probs of a well over all the segments
+        return np.concatenate([
+            self.segment(segment_idx, 'probs')[well_idx]
+            for segment_idx in range(len(self.manifest['segments']))])
+
+    def all_signals(self):
+        # (n_frames - 1, n_wells) label difference signals
+        return np.concatenate([
+            self.segment(segment_idx, 'signals')
+            for segment_idx in range(len(self.manifest['segments']))])[1:]
+
+    def save_labels(self, path):
+        '''
+        Save the packed labels of all the wells as an npy file (n_wells,
+        n_frames, 392), which is read frame by frame as a memory map.
+        '''
+        labels = np.lib.format.open_memmap(
+                path + '.tmp', mode='w+', dtype=np.uint8,
+                shape=(self.n_wells, len(self.frames), PACKED_SIZE))
+
+        start = 0
+        for segment_idx in range(len(self.manifest['segments'])):
+            segment_labels = self.segment(segment_idx, 'labels')
+            stop = start + segment_labels.shape[1]
+
+            # A well at a time to read the segment sequentially
+            for well_idx in range(self.n_wells):
+                labels[well_idx, start:stop] = segment_labels[well_idx]
+            start = stop
+
+        labels.flush()
+        del labels
+
+        os.replace(path + '.tmp', path)
+
+    def save_npz(self, path):
+        '''
+        Save the probs of all the wells as a compressed npz of an array
+        (n_wells, n_frames, 56, 56), the same as np.savez_compressed()
+        gives, reading a well at a time.
+        '''
+        header = {
+                'descr': np.lib.format.dtype_to_descr(np.dtype(np.uint8)),
+                'fortran_order': False,
+                'shape': (self.n_wells, len(self.frames)) + PROB_SHAPE}
+
+        with zipfile.ZipFile(path, mode='w',
+                compression=zipfile.ZIP_DEFLATED, allowZip64=True) as zipf:
+            with zipf.open('arr_0.npy', 'w', force_zip64=True) as f:
+                np.lib.format.write_array_header_1_0(f, header)
+
+                for well_idx in range(self.n_wells):
+                    f.write(self.well_probs(well_idx).tobytes())
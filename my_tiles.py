@@ -0,0 +1,89 @@
+# -*- coding: utf-8 -*-
+# vim: set fileencoding=utf-8 :
+# vim: set foldmethod=marker commentstring=\ \ #\ %s :
+#
+# Author:    Taishi Matsumura
+# Created:   2026-10-18
+#
+# Copyright (C) 2026 Taishi Matsumura
+#
+import os
+import PIL.Image
+import numpy as np
+import my_mask
+
+
+def tile_shape(boxes):
+    '''
+    (height, width) of the tiles, which hold the largest well image.
+    '''
+    return (int((boxes[:, 1] - boxes[:, 0]).max()),
+            int((boxes[:, 3] - boxes[:, 2]).max()))
+
+
+def make_tiles(dataset_path, orgimg_paths, boxes, progress=iter):
+    '''
+    Cut all the frames into well images and save them as tiles.npy.
+
+    The tiles are a well-major uint8 cube (n_wells, n_frames, height,
+    width), so that the images of a well are read with a slice of a
+    memory-mapped file. A well image smaller than the tiles is put at the
+    upper left of its tile.
+
+    Input
+    -----
+    dataset_path : str
+    orgimg_paths : list of the paths to the original images
+    boxes : ndarray (n_wells, 4), bounding boxes of the wells
+    progress : wrapper of the iteration over the frames, e.g. tqdm
+    '''
+    height, width = tile_shape(boxes)
+
+    out_path = os.path.join(dataset_path, 'tiles.npy')
+    tmp_path = out_path + '.tmp'
+
+    tiles = np.lib.format.open_memmap(
+            tmp_path, mode='w+', dtype=np.uint8,
+            shape=(len(boxes), len(orgimg_paths), height, width))
+
+    for time, orgimg_path in enumerate(progress(orgimg_paths)):
+        org_img = np.array(
+                PIL.Image.open(orgimg_path).convert('L'), dtype=np.uint8)
+
+        for well_idx, box in enumerate(boxes):
+            well_img = my_mask.crop(org_img, box)
+            tiles[well_idx, time, :well_img.shape[0], :well_img.shape[1]] =  \
+                    well_img
+
+    tiles.flush()
+    del tiles
+
+    # Replace the file at once not to leave a broken one
+    os.replace(tmp_path, out_path)
+
+
+def load_tiles(dataset_path):
+    '''
+    Open tiles.npy read-only as a memory map.
+
+    Returns None if the file does not exist or is older than mask.npy.
+    '''
+    tiles_path = os.path.join(dataset_path, 'tiles.npy')
+    mask_path = os.path.join(dataset_path, 'mask.npy')
+
+    if not os.path.exists(tiles_path):
+        return None
+
+    if os.stat(tiles_path).st_mtime_ns < os.stat(mask_path).st_mtime_ns:
+        return None
+
+    return np.load(tiles_path, mmap_mode='r')
+
+
+def get_tile(tiles, box, well_idx, time):
+    '''
+    The image of a well at a frame, the same as my_mask.crop() gives from
+    the original image. It is a view of the memory map (no copy).
+    '''
+    row_min, row_max, clm_min, clm_max = box
+    return tiles[well_idx, time, :row_max-row_min, :clm_max-clm_min]
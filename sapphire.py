@@ -9,20 +9,30 @@
 #
 import io
 import os
-import glob
 import dash
 import json
+import flask
 import base64
+import hashlib
 import shutil
 import zipfile
 import datetime
+import functools
+import threading
+import concurrent.futures
 import PIL.Image
 import dash_table
 import numpy as np
 import pandas as pd
 import urllib.parse
-import scipy.signal
-import my_threshold
+import my_cache
+import my_catalog
+import my_detect
+import my_mask
+import my_probs
+import my_labels
+import my_tiles
+import my_pyramid
 import dash_core_components as dcc
 import dash_html_components as html
 from dash.dependencies import Input, Output, State
@@ -38,9 +48,45 @@ ALPHABETS = [chr(i) for i in range(65, 65 + 26)]
 
 DATA_ROOT = './data_root_for_demo'
 
-THETA = 50
+THRESH_FUNC = my_detect.THRESH_FUNC
 
-THRESH_FUNC = my_threshold.minmax
+# Upper limit of memory used to keep activity signals loaded [bytes]
+SIGNAL_CACHE_SIZE = 2 * 1024**3
+
+SIGNAL_CACHE = my_cache.SignalCache(SIGNAL_CACHE_SIZE)
+
+# Upper limit of memory used to keep results of analyze() [bytes]
+ANALYSIS_CACHE_SIZE = 1 * 1024**3
+
+ANALYSIS_CACHE = my_cache.LRUCache(ANALYSIS_CACHE_SIZE)
+
+# Upper limit of memory used to keep JPEG images sent to the browser [bytes]
+IMAGE_CACHE_SIZE = 256 * 1024**2
+
+IMAGE_CACHE = my_cache.LRUCache(IMAGE_CACHE_SIZE)
+
+# Time for which the browser keeps the images [s]
+IMAGE_MAX_AGE = 7 * 24 * 60 * 60
+
+# Original images are previewed at 1/2**level of their size (level <= 3)
+MAX_PREVIEW_LEVEL = 3
+
+# Number of frames before and after a served well image to load in advance
+PREFETCH_FRAMES = 3
+
+IMAGE_PREFETCHER = my_cache.Prefetcher(IMAGE_CACHE, max_workers=2)
+
+# Number of buckets of frames in which a signal is drawn by min and max
+TRACE_BUCKETS = 800
+
+# Listings of frames, inference profiles and signal files under data_root
+CATALOG = my_catalog.Catalog()
+
+# Number of threads reading the timestamps of the frames
+TIMESTAMP_WORKERS = 16
+
+# Leading bytes of a JPEG file read for its EXIF [bytes]
+EXIF_HEADER_SIZE = 256 * 1024
 
 
 app = dash.Dash('Sapphire')
@@ -828,18 +874,127 @@ app.layout = html.Div([
 ], style={'width': '1400px',},)
 
 
-# =========================================
-#  Smoothing signals with gaussian window
-# =========================================
-def my_filter(signals, size=10, sigma=5):
-    
-    window = scipy.signal.gaussian(size, sigma)
+# ==============================================
+#  Analysis of signals shared by the callbacks
+# ==============================================
+def analyze(data_root, env, morph, target_dir, signal_name, detect,
+        size, sigma, smooth, weight, weight_style, midpoints, coef, method,
+        pupar_times=None):
+    '''
+    Season the signals and detect the event timings of all the wells.
+
+    Most of the figures are drawn from the same seasoned signals and
+    event timings, so the results are memoized on the analysis parameters
+    and shared by the callbacks. The seasoned signals are kept apart from
+    the event timings, so that changing only the coefficient or the
+    detection method does not season the signals again.
+
+    Output
+    ------
+    signals : ndarray (n_wells, n_frames), read-only
+    thresholds : ndarray (n_wells, 1), read-only
+    auto_evals : ndarray (n_wells,), read-only
+    '''
+    signals, signals_key = season_signals(
+            data_root, env, morph, target_dir, signal_name, detect,
+            size, sigma, smooth, weight, weight_style, midpoints, pupar_times)
+
+    def evaluate():
+        thresholds = THRESH_FUNC(signals, coef=coef)
+        auto_evals = my_detect.detect_event(
+                signals, thresholds, morph, detect, method)
+        thresholds.setflags(write=False)
+        auto_evals.setflags(write=False)
+
+        return thresholds, auto_evals
+
+    thresholds, auto_evals = ANALYSIS_CACHE.get_or_load(
+            ('events', signals_key, coef, method), evaluate)
+
+    return signals, thresholds, auto_evals
+
+
+def season_signals(data_root, env, morph, target_dir, signal_name, detect,
+        size, sigma, smooth, weight, weight_style, midpoints,
+        pupar_times=None):
+    '''
+    Seasoned signals shared by analyze() and signal_pyramid(), and the key
+    of the parameters which affect them.
+    '''
+    path = signal_path(data_root, env, morph, target_dir, signal_name)
+
+    # Normalize the parameters which do not affect the results. pupar_times
+    # is not used by seasoning() at present, so it is not a part of the key
+    # either, and the adult signals are not seasoned again for each change
+    # of the larva side.
+    signals_key = (
+            my_cache.file_key(path), signal_name, morph, detect,
+            (size, sigma) if smooth else None,
+            (weight_style, tuple(midpoints['midpoint'])) if weight else None)
+
+    def season():
+        signals = my_detect.seasoning(
+                load_signals(data_root, env, morph, target_dir, signal_name),
+                morph, detect, size, sigma,
+                smooth=smooth,
+                weight=weight,
+                pupar_times=pupar_times,
+                midpoints=midpoints,
+                weight_style=weight_style)
+        signals.setflags(write=False)
+
+        return signals
 
-    signals = np.array(
-            [np.convolve(signal, window, mode='same')
-                for signal in signals])
+    if smooth or weight:
+        signals = ANALYSIS_CACHE.get_or_load(('signals',) + signals_key, season)
 
-    return signals
+    else:
+        # Nothing to season, the signals are kept by the signal cache
+        signals = load_signals(data_root, env, morph, target_dir, signal_name)
+
+    return signals, signals_key
+
+
+def signal_pyramid(data_root, env, morph, target_dir, signal_name, detect,
+        size, sigma, smooth, weight, weight_style, midpoints,
+        pupar_times=None):
+    '''
+    Min/max pyramid of the signals given by analyze() with the same
+    parameters. That of the raw signals is read from its sidecar, and
+    that of seasoned signals or of the signals at a theta is built once
+    and kept in ANALYSIS_CACHE.
+    '''
+    if not (smooth or weight):
+        pyramid = load_pyramid(data_root, env, morph, target_dir, signal_name)
+        if pyramid is not None:
+            return pyramid
+
+    signals, signals_key = season_signals(
+            data_root, env, morph, target_dir, signal_name, detect,
+            size, sigma, smooth, weight, weight_style, midpoints, pupar_times)
+
+    return ANALYSIS_CACHE.get_or_load(
+            ('pyramid',) + signals_key,
+            lambda: my_pyramid.build_pyramid(signals))
+
+
+def signal_extrema(signals, pyramid):
+    '''
+    Max of all the signals, and the max and min of each well (n_wells,),
+    read from the coarsest level of the pyramid, which covers all the
+    frames in a few hundred buckets.
+    '''
+    if len(pyramid) > 0:
+        mins, maxs = pyramid[-1]
+
+    else:
+        # Signals too short to make a level
+        mins = maxs = signals
+
+    well_maxs = maxs.max(axis=1)
+    well_mins = mins.min(axis=1)
+
+    return well_maxs.max(), well_maxs, well_mins
 
 
 # =================================================
@@ -850,8 +1005,7 @@ def my_filter(signals, size=10, sigma=5):
         [Input('data-root', 'children')])
 def callback(data_root):
 
-    imaging_envs = [os.path.basename(i)
-            for i in sorted(glob.glob(os.path.join(data_root, '*')))]
+    imaging_envs = CATALOG.datasets(data_root)
 
     return [{'label': i, 'value': i} for i in imaging_envs]
 
@@ -925,10 +1079,7 @@ def callback(detect, data_root, env):
     if detect == 'eclosion' or detect == 'death':
         return []
 
-    results = [os.path.basename(i)
-            for i in sorted(glob.glob(os.path.join(
-                data_root, glob.escape(env), 'inference', 'larva', '*')))
-            if os.path.isdir(i)]
+    results = CATALOG.profiles(data_root, env, 'larva')
 
     return [{'label': i, 'value': i} for i in results]
 
@@ -978,10 +1129,7 @@ def callback(detect, data_root, env):
     if detect == 'pupariation':
         return []
 
-    results = [os.path.basename(i)
-            for i in sorted(glob.glob(os.path.join(
-                data_root, glob.escape(env), 'inference', 'adult', '*')))
-            if os.path.isdir(i)]
+    results = CATALOG.profiles(data_root, env, 'adult')
 
     return [{'label': i, 'value': i} for i in results]
 
@@ -1179,8 +1327,7 @@ def callback(env, data_root):
     if env is None:
         return
 
-    return len(glob.glob(os.path.join(
-            data_root, glob.escape(env), 'original', '*.jpg'))) - 2
+    return CATALOG.n_frames(data_root, env) - 2
 
 
 @app.callback(
@@ -1198,8 +1345,7 @@ def callback(env, data_root):
     if env is None:
         return 100
 
-    return len(glob.glob(os.path.join(
-            data_root, glob.escape(env), 'original', '*.jpg'))) - 2
+    return CATALOG.n_frames(data_root, env) - 2
 
 
 @app.callback(
@@ -1290,12 +1436,7 @@ def callback(larva, data_root, dataset_name):
     if larva is None or dataset_name is None:
         return []
 
-    signal_files = sorted(glob.glob(os.path.join(
-            data_root, glob.escape(dataset_name), 'inference',
-            'larva', larva, '*signals.npy')))
-    signal_files = [os.path.basename(file_path) for file_path in signal_files]
-
-    return [{'label': i, 'value': i} for i in signal_files]
+    return signal_options(data_root, dataset_name, 'larva', larva)
 
 
 @app.callback(
@@ -1308,12 +1449,7 @@ def callback(adult, data_root, dataset_name):
     if adult is None or dataset_name is None:
         return []
 
-    signal_files = sorted(glob.glob(os.path.join(
-            data_root, glob.escape(dataset_name), 'inference',
-            'adult', adult, '*signals.npy')))
-    signal_files = [os.path.basename(file_path) for file_path in signal_files]
-
-    return [{'label': i, 'value': i} for i in signal_files]
+    return signal_options(data_root, dataset_name, 'adult', adult)
 
 
 @app.callback(
@@ -1530,37 +1666,16 @@ def callback(time, well_idx, data_root, env):
     if env is None:
         return
 
-    # Load the mask
-    mask = np.load(os.path.join(data_root, env, 'mask.npy'))
-
-    # Load an original image
-    orgimg_paths = sorted(glob.glob(
-            os.path.join(data_root, glob.escape(env), 'original', '*.jpg')))
-    orgimg1 = np.array(
-            PIL.Image.open(orgimg_paths[time]).convert('L'), dtype=np.uint8)
-    orgimg2 = np.array(
-            PIL.Image.open(orgimg_paths[time+1]).convert('L'), dtype=np.uint8)
-
-    # Cut out an well image from the original image
-    r, c = np.where(mask == well_idx)
-    orgimg1 = orgimg1[r.min():r.max(), c.min():c.max()]
-    orgimg2 = orgimg2[r.min():r.max(), c.min():c.max()]
-    orgimg1 = PIL.Image.fromarray(orgimg1)
-    orgimg2 = PIL.Image.fromarray(orgimg2)
-
-    # Buffer the well image as byte stream
-    buf1 = io.BytesIO()
-    buf2 = io.BytesIO()
-    orgimg1.save(buf1, format='JPEG')
-    orgimg2.save(buf2, format='JPEG')
+    # URLs of the well images at t and t+1
+    url1 = image_url(data_root, 'well', env, time, well_idx)
+    url2 = image_url(data_root, 'well', env, time+1, well_idx)
 
     return [
             html.Div('Image at "t"',
                     style={'display': 'inline-block', 'margin-right': '25px'}),
             html.Div('"t+1"', style={'display': 'inline-block'}),
             html.Img(
-                src='data:image/jpeg;base64,{}'.format(
-                        base64.b64encode(buf1.getvalue()).decode('utf-8')),
+                src=url1,
                 style={
                     'background': '#555555',
                     'height': '65px',
@@ -1570,8 +1685,7 @@ def callback(time, well_idx, data_root, env):
                 },
             ),
             html.Img(
-                src='data:image/jpeg;base64,{}'.format(
-                        base64.b64encode(buf2.getvalue()).decode('utf-8')),
+                src=url2,
                 style={
                     'background': '#555555',
                     'height': '65px',
@@ -1605,41 +1719,21 @@ def callback(time, well_idx, larva, adult, data_root, env, detect):
         if larva is None:
             return
 
-        # Load a npz file storing prob images
-        # and get a prob image
-        larva_probs = np.load(os.path.join(
-                data_root, env, 'inference', 'larva', larva, 'probs',
-                '{:03d}.npz'.format(well_idx)))['arr_0'].astype(np.int32)
-
-        larva_prob_img1 = PIL.Image.fromarray(
-                larva_probs[time] / 100 * 255).convert('L')
-        larva_prob_img2 = PIL.Image.fromarray(
-                larva_probs[time+1] / 100 * 255).convert('L')
-
-        larva_label_img1 = PIL.Image.fromarray(
-                ((larva_probs[time] > THETA) * 255).astype(np.uint8)
-                ).convert('L')
-        larva_label_img2 = PIL.Image.fromarray(
-                ((larva_probs[time+1] > THETA) * 255).astype(np.uint8)
-                ).convert('L')
-
-        # Buffer the well image as byte stream
-        larva_prob_buf1 = io.BytesIO()
-        larva_prob_buf2 = io.BytesIO()
-        larva_label_buf1 = io.BytesIO()
-        larva_label_buf2 = io.BytesIO()
-        larva_prob_img1.save(larva_prob_buf1, format='JPEG')
-        larva_prob_img2.save(larva_prob_buf2, format='JPEG')
-        larva_label_img1.save(larva_label_buf1, format='JPEG')
-        larva_label_img2.save(larva_label_buf2, format='JPEG')
+        # URLs of the label and prob images at t and t+1
+        larva_label_url1 = image_url(
+                data_root, 'label', env, time, well_idx, 'larva', larva)
+        larva_label_url2 = image_url(
+                data_root, 'label', env, time+1, well_idx, 'larva', larva)
+        larva_prob_url1 = image_url(
+                data_root, 'prob', env, time, well_idx, 'larva', larva)
+        larva_prob_url2 = image_url(
+                data_root, 'prob', env, time+1, well_idx, 'larva', larva)
 
         data = [
             html.Div('Larva'),
             html.Div([
                 html.Img(
-                    src='data:image/jpeg;base64,{}'.format(
-                            base64.b64encode(
-                                larva_label_buf1.getvalue()).decode('utf-8')),
+                    src=larva_label_url1,
                     style={
                         'background': '#555555',
                         'height': '65px',
@@ -1649,9 +1743,7 @@ def callback(time, well_idx, larva, adult, data_root, env, detect):
                     },
                 ),
                 html.Img(
-                    src='data:image/jpeg;base64,{}'.format(
-                            base64.b64encode(
-                                larva_label_buf2.getvalue()).decode('utf-8')),
+                    src=larva_label_url2,
                     style={
                         'background': '#555555',
                         'height': '65px',
@@ -1663,9 +1755,7 @@ def callback(time, well_idx, larva, adult, data_root, env, detect):
             ]),
             html.Div([
                 html.Img(
-                    src='data:image/jpeg;base64,{}'.format(
-                            base64.b64encode(
-                                larva_prob_buf1.getvalue()).decode('utf-8')),
+                    src=larva_prob_url1,
                     style={
                         'background': '#555555',
                         'height': '65px',
@@ -1675,9 +1765,7 @@ def callback(time, well_idx, larva, adult, data_root, env, detect):
                     },
                 ),
                 html.Img(
-                    src='data:image/jpeg;base64,{}'.format(
-                            base64.b64encode(
-                                larva_prob_buf2.getvalue()).decode('utf-8')),
+                    src=larva_prob_url2,
                     style={
                         'background': '#555555',
                         'height': '65px',
@@ -1696,41 +1784,21 @@ def callback(time, well_idx, larva, adult, data_root, env, detect):
             pass
 
         else:
-            # Load a npz file storing prob images
-            # and get a prob image
-            larva_probs = np.load(os.path.join(
-                    data_root, env, 'inference', 'larva', larva, 'probs',
-                    '{:03d}.npz'.format(well_idx)))['arr_0'].astype(np.int32)
-
-            larva_prob_img1 = PIL.Image.fromarray(
-                    larva_probs[time] / 100 * 255).convert('L')
-            larva_prob_img2 = PIL.Image.fromarray(
-                    larva_probs[time+1] / 100 * 255).convert('L')
-
-            larva_label_img1 = PIL.Image.fromarray(
-                    ((larva_probs[time] > THETA) * 255).astype(np.uint8)
-                    ).convert('L')
-            larva_label_img2 = PIL.Image.fromarray(
-                    ((larva_probs[time+1] > THETA) * 255).astype(np.uint8)
-                    ).convert('L')
-
-            # Buffer the well image as byte stream
-            larva_prob_buf1 = io.BytesIO()
-            larva_prob_buf2 = io.BytesIO()
-            larva_label_buf1 = io.BytesIO()
-            larva_label_buf2 = io.BytesIO()
-            larva_prob_img1.save(larva_prob_buf1, format='JPEG')
-            larva_prob_img2.save(larva_prob_buf2, format='JPEG')
-            larva_label_img1.save(larva_label_buf1, format='JPEG')
-            larva_label_img2.save(larva_label_buf2, format='JPEG')
+            # URLs of the label and prob images at t and t+1
+            larva_label_url1 = image_url(
+                    data_root, 'label', env, time, well_idx, 'larva', larva)
+            larva_label_url2 = image_url(
+                    data_root, 'label', env, time+1, well_idx, 'larva', larva)
+            larva_prob_url1 = image_url(
+                    data_root, 'prob', env, time, well_idx, 'larva', larva)
+            larva_prob_url2 = image_url(
+                    data_root, 'prob', env, time+1, well_idx, 'larva', larva)
 
             data = data + [
                 html.Div('Larva'),
                 html.Div([
                     html.Img(
-                        src='data:image/jpeg;base64,{}'.format(
-                                base64.b64encode(
-                                    larva_label_buf1.getvalue()).decode('utf-8')),
+                        src=larva_label_url1,
                         style={
                             'background': '#555555',
                             'height': '65px',
@@ -1740,9 +1808,7 @@ def callback(time, well_idx, larva, adult, data_root, env, detect):
                         },
                     ),
                     html.Img(
-                        src='data:image/jpeg;base64,{}'.format(
-                                base64.b64encode(
-                                    larva_label_buf2.getvalue()).decode('utf-8')),
+                        src=larva_label_url2,
                         style={
                             'background': '#555555',
                             'height': '65px',
@@ -1754,9 +1820,7 @@ def callback(time, well_idx, larva, adult, data_root, env, detect):
                 ]),
                 html.Div([
                     html.Img(
-                        src='data:image/jpeg;base64,{}'.format(
-                                base64.b64encode(
-                                    larva_prob_buf1.getvalue()).decode('utf-8')),
+                        src=larva_prob_url1,
                         style={
                             'background': '#555555',
                             'height': '65px',
@@ -1766,9 +1830,7 @@ def callback(time, well_idx, larva, adult, data_root, env, detect):
                         },
                     ),
                     html.Img(
-                        src='data:image/jpeg;base64,{}'.format(
-                                base64.b64encode(
-                                    larva_prob_buf2.getvalue()).decode('utf-8')),
+                        src=larva_prob_url2,
                         style={
                             'background': '#555555',
                             'height': '65px',
@@ -1784,38 +1846,21 @@ def callback(time, well_idx, larva, adult, data_root, env, detect):
             pass
 
         else:
-            adult_probs = np.load(os.path.join(
-                    data_root, env, 'inference', 'adult', adult, 'probs',
-                    '{:03d}.npz'.format(well_idx)))['arr_0'].astype(np.int32)
-
-            adult_prob_img1 = PIL.Image.fromarray(
-                    adult_probs[time] / 100 * 255).convert('L')
-            adult_prob_img2 = PIL.Image.fromarray(
-                    adult_probs[time+1] / 100 * 255).convert('L')
-
-            adult_label_img1 = PIL.Image.fromarray(
-                    ((adult_probs[time] > THETA) * 255).astype(np.uint8)
-                    ).convert('L')
-            adult_label_img2 = PIL.Image.fromarray(
-                    ((adult_probs[time+1] > THETA) * 255).astype(np.uint8)
-                    ).convert('L')
-
-            adult_prob_buf1 = io.BytesIO()
-            adult_prob_buf2 = io.BytesIO()
-            adult_label_buf1 = io.BytesIO()
-            adult_label_buf2 = io.BytesIO()
-            adult_prob_img1.save(adult_prob_buf1, format='JPEG')
-            adult_prob_img2.save(adult_prob_buf2, format='JPEG')
-            adult_label_img1.save(adult_label_buf1, format='JPEG')
-            adult_label_img2.save(adult_label_buf2, format='JPEG')
+            # URLs of the label and prob images at t and t+1
+            adult_label_url1 = image_url(
+                    data_root, 'label', env, time, well_idx, 'adult', adult)
+            adult_label_url2 = image_url(
+                    data_root, 'label', env, time+1, well_idx, 'adult', adult)
+            adult_prob_url1 = image_url(
+                    data_root, 'prob', env, time, well_idx, 'adult', adult)
+            adult_prob_url2 = image_url(
+                    data_root, 'prob', env, time+1, well_idx, 'adult', adult)
 
             data = data + [
                 html.Div('Adult'),
                 html.Div([
                     html.Img(
-                        src='data:image/jpeg;base64,{}'.format(
-                                base64.b64encode(
-                                    adult_label_buf1.getvalue()).decode('utf-8')),
+                        src=adult_label_url1,
                         style={
                             'background': '#555555',
                             'height': '65px',
@@ -1825,9 +1870,7 @@ def callback(time, well_idx, larva, adult, data_root, env, detect):
                         },
                     ),
                     html.Img(
-                        src='data:image/jpeg;base64,{}'.format(
-                                base64.b64encode(
-                                    adult_label_buf2.getvalue()).decode('utf-8')),
+                        src=adult_label_url2,
                         style={
                             'background': '#555555',
                             'height': '65px',
@@ -1839,9 +1882,7 @@ def callback(time, well_idx, larva, adult, data_root, env, detect):
                 ]),
                 html.Div([
                     html.Img(
-                        src='data:image/jpeg;base64,{}'.format(
-                                base64.b64encode(
-                                    adult_prob_buf1.getvalue()).decode('utf-8')),
+                        src=adult_prob_url1,
                         style={
                             'background': '#555555',
                             'height': '65px',
@@ -1851,9 +1892,7 @@ def callback(time, well_idx, larva, adult, data_root, env, detect):
                         },
                     ),
                     html.Img(
-                        src='data:image/jpeg;base64,{}'.format(
-                                base64.b64encode(
-                                    adult_prob_buf2.getvalue()).decode('utf-8')),
+                        src=adult_prob_url2,
                         style={
                             'background': '#555555',
                             'height': '65px',
@@ -1870,41 +1909,21 @@ def callback(time, well_idx, larva, adult, data_root, env, detect):
         if adult is None:
             return
 
-        # Load a npz file storing prob images
-        # and get a prob image
-        adult_probs = np.load(os.path.join(
-                data_root, env, 'inference', 'adult', adult, 'probs',
-                '{:03d}.npz'.format(well_idx)))['arr_0'].astype(np.int32)
-
-        adult_prob_img1 = PIL.Image.fromarray(
-                adult_probs[time] / 100 * 255).convert('L')
-        adult_prob_img2 = PIL.Image.fromarray(
-                adult_probs[time+1] / 100 * 255).convert('L')
-
-        adult_label_img1 = PIL.Image.fromarray(
-                ((adult_probs[time] > THETA) * 255).astype(np.uint8)
-                ).convert('L')
-        adult_label_img2 = PIL.Image.fromarray(
-                ((adult_probs[time+1] > THETA) * 255).astype(np.uint8)
-                ).convert('L')
-
-        # Buffer the well image as byte stream
-        adult_prob_buf1 = io.BytesIO()
-        adult_prob_buf2 = io.BytesIO()
-        adult_label_buf1 = io.BytesIO()
-        adult_label_buf2 = io.BytesIO()
-        adult_prob_img1.save(adult_prob_buf1, format='JPEG')
-        adult_prob_img2.save(adult_prob_buf2, format='JPEG')
-        adult_label_img1.save(adult_label_buf1, format='JPEG')
-        adult_label_img2.save(adult_label_buf2, format='JPEG')
+        # URLs of the label and prob images at t and t+1
+        adult_label_url1 = image_url(
+                data_root, 'label', env, time, well_idx, 'adult', adult)
+        adult_label_url2 = image_url(
+                data_root, 'label', env, time+1, well_idx, 'adult', adult)
+        adult_prob_url1 = image_url(
+                data_root, 'prob', env, time, well_idx, 'adult', adult)
+        adult_prob_url2 = image_url(
+                data_root, 'prob', env, time+1, well_idx, 'adult', adult)
 
         data = [
             html.Div('Adult'),
             html.Div([
                 html.Img(
-                    src='data:image/jpeg;base64,{}'.format(
-                            base64.b64encode(
-                                adult_label_buf1.getvalue()).decode('utf-8')),
+                    src=adult_label_url1,
                     style={
                         'background': '#555555',
                         'height': '65px',
@@ -1914,9 +1933,7 @@ def callback(time, well_idx, larva, adult, data_root, env, detect):
                     },
                 ),
                 html.Img(
-                    src='data:image/jpeg;base64,{}'.format(
-                            base64.b64encode(
-                                adult_label_buf2.getvalue()).decode('utf-8')),
+                    src=adult_label_url2,
                     style={
                         'background': '#555555',
                         'height': '65px',
@@ -1928,9 +1945,7 @@ def callback(time, well_idx, larva, adult, data_root, env, detect):
             ]),
             html.Div([
                 html.Img(
-                    src='data:image/jpeg;base64,{}'.format(
-                            base64.b64encode(
-                                adult_prob_buf1.getvalue()).decode('utf-8')),
+                    src=adult_prob_url1,
                     style={
                         'background': '#555555',
                         'height': '65px',
@@ -1940,9 +1955,7 @@ def callback(time, well_idx, larva, adult, data_root, env, detect):
                     },
                 ),
                 html.Img(
-                    src='data:image/jpeg;base64,{}'.format(
-                            base64.b64encode(
-                                adult_prob_buf2.getvalue()).decode('utf-8')),
+                    src=adult_prob_url2,
                     style={
                         'background': '#555555',
                         'height': '65px',
@@ -1963,10 +1976,11 @@ def callback(time, well_idx, larva, adult, data_root, env, detect):
 @app.callback(
         Output('current-well', 'figure'),
         [Input('time-selector', 'value'),
-         Input('well-selector', 'value')],
+         Input('well-selector', 'value'),
+         Input('current-well', 'relayoutData')],
         [State('data-root', 'children'),
          State('env-dropdown', 'value')])
-def callback(time, well_idx, data_root, env):
+def callback(time, well_idx, layout, data_root, env):
     # Guard
     if env is None:
         return {'data': []}
@@ -1979,18 +1993,23 @@ def callback(time, well_idx, data_root, env):
 
     xs, ys = well_coordinates(params)
 
-    # Load an original image
-    orgimg_paths = sorted(glob.glob(
-            os.path.join(data_root, glob.escape(env), 'original', '*.jpg')))
-    org_img = PIL.Image.open(orgimg_paths[time]).convert('L')
+    # Size of an original image (only the header is read)
+    orgimg_paths = CATALOG.frames(data_root, env)
+    with PIL.Image.open(orgimg_paths[time]) as image:
+        width, height = image.size
 
-    # Buffer the well image as byte stream
-    buf = io.BytesIO()
-    org_img.save(buf, format='JPEG')
-    data_uri = 'data:image/jpeg;base64,{}'.format(
-            base64.b64encode(buf.getvalue()).decode('utf-8'))
+    # Keep the zoomed range
+    xrange = relayout_xrange(layout) or [0, width]
 
-    height, width = np.array(org_img).shape
+    if layout is not None and 'yaxis.range[0]' in layout:
+        yrange = [layout['yaxis.range[0]'], layout['yaxis.range[1]']]
+    else:
+        yrange = [0, height]
+
+    # URL of a preview as fine as the zoomed range on the figure
+    orgimg_url = image_url(
+            data_root, 'frame', env, time,
+            level=preview_level(xrange[1] - xrange[0], 200))
 
     # A coordinate of selected well
     selected_x = xs[well_idx:well_idx+1]
@@ -1998,31 +2017,32 @@ def callback(time, well_idx, data_root, env):
 
     # Bounding boxes of groups
     if os.path.exists(os.path.join(data_root, env, 'grouping.csv')):
-        mask = np.load(os.path.join(data_root, env, 'mask.npy'))
-        mask = np.flipud(mask)
-
         groups = np.loadtxt(
                 os.path.join(data_root, env, 'grouping.csv'),
                 dtype=np.int32, delimiter=',').flatten()
 
-        for well_idx, group_id in enumerate(groups):
-            mask[mask==well_idx] = group_id
+        # Bounding boxes of the wells, upside down as the image
+        boxes = load_bounding_boxes(data_root, env)[:len(groups)]
+        r_mins = height - 1 - boxes[:, 1]
+        r_maxs = height - 1 - boxes[:, 0]
+        c_mins = boxes[:, 2]
+        c_maxs = boxes[:, 3]
 
         bounding_boxes = [
                 {
                     'x': [
-                        np.where(mask == group_id)[1].min(),
-                        np.where(mask == group_id)[1].max(),
-                        np.where(mask == group_id)[1].max(),
-                        np.where(mask == group_id)[1].min(),
-                        np.where(mask == group_id)[1].min(),
+                        c_mins[groups == group_id].min(),
+                        c_maxs[groups == group_id].max(),
+                        c_maxs[groups == group_id].max(),
+                        c_mins[groups == group_id].min(),
+                        c_mins[groups == group_id].min(),
                     ],
                     'y': [
-                        np.where(mask == group_id)[0].min(),
-                        np.where(mask == group_id)[0].min(),
-                        np.where(mask == group_id)[0].max(),
-                        np.where(mask == group_id)[0].max(),
-                        np.where(mask == group_id)[0].min(),
+                        r_mins[groups == group_id].min(),
+                        r_mins[groups == group_id].min(),
+                        r_maxs[groups == group_id].max(),
+                        r_maxs[groups == group_id].max(),
+                        r_mins[groups == group_id].min(),
                     ],
                     'name': 'Group{}'.format(group_id),
                     'mode': 'lines',
@@ -2081,13 +2101,13 @@ def callback(time, well_idx, data_root, env):
                 'height': 400,
                 'margin': go.layout.Margin(l=0, b=0, t=0, r=0),
                 'xaxis': {
-                    'range': (0, width),
+                    'range': xrange,
                     'scaleanchor': 'y',
                     'scaleratio': 1,
                     'showgrid': False,
                 },
                 'yaxis': {
-                    'range': (0, height),
+                    'range': yrange,
                     'showgrid': False,
                 },
                 'images': [{
@@ -2100,7 +2120,7 @@ def callback(time, well_idx, data_root, env):
                     'sizex': width,
                     'sizey': height,
                     'layer': 'below',
-                    'source': data_uri,
+                    'source': orgimg_url,
                 }],
                 'dragmode': 'zoom',
                 'hovermode': 'closest',
@@ -2178,8 +2198,7 @@ def callback(env, data_root):
     if env is None:
         return 100
 
-    return len(glob.glob(os.path.join(
-            data_root, glob.escape(env), 'original', '*.jpg'))) - 2
+    return CATALOG.n_frames(data_root, env) - 2
 
 
 @app.callback(
@@ -2203,8 +2222,7 @@ def callback(env, data_root):
     if env is None:
         return 100
 
-    return len(glob.glob(os.path.join(
-            data_root, glob.escape(env), 'original', '*.jpg'))) - 2
+    return CATALOG.n_frames(data_root, env) - 2
 
 
 @app.callback(
@@ -2266,14 +2284,15 @@ def callback(midpoint, midpoints, well_idx, data_root, dataset_name):
          Input('larva-window-size', 'value'),
          Input('larva-window-sigma', 'value'),
          Input('larva-signal-type', 'value'),
-         Input('detection-method', 'value')],
+         Input('detection-method', 'value'),
+         Input('larva-signal', 'relayoutData')],
         [State('data-root', 'children'),
          State('env-dropdown', 'value'),
          State('detect-target', 'value'),
          State('larva-dropdown', 'value'),
          State('hidden-timestamp', 'data')])
 def callback(well_idx, coef, time, midpoints, weight, style,
-        checks, size, sigma, signal_name, method,
+        checks, size, sigma, signal_name, method, layout,
         data_root, env, detect, larva, timestamps):
     # Guard
     if env is None:
@@ -2285,21 +2304,26 @@ def callback(well_idx, coef, time, midpoints, weight, style,
     manual_data = []
     common_data = []
 
-    # Load the data
-    larva_diffs = np.load(os.path.join(
-            data_root, env, 'inference', 'larva', larva, signal_name)).T
-
-    larva_diffs = seasoning(
-            larva_diffs, 'larva', detect, size, sigma,
+    # Analyze the signals
+    larva_diffs, thresholds, auto_evals = analyze(
+            data_root, env, 'larva', larva, signal_name, detect,
+            size, sigma,
             smooth=len(checks) != 0,
             weight=len(weight) != 0,
-            pupar_times=None,
+            weight_style=style,
             midpoints=midpoints,
-            weight_style=style)
+            coef=coef,
+            method=method)
 
-    thresholds = THRESH_FUNC(larva_diffs, coef=coef)
-
-    auto_evals = detect_event(larva_diffs, thresholds, 'larva', detect, method)
+    # Min/max of the signals to draw, which also gives the extrema
+    pyramid = signal_pyramid(
+            data_root, env, 'larva', larva, signal_name, detect,
+            size, sigma,
+            smooth=len(checks) != 0,
+            weight=len(weight) != 0,
+            weight_style=style,
+            midpoints=midpoints)
+    diffs_max, well_maxs, well_mins = signal_extrema(larva_diffs, pyramid)
 
     if os.path.exists(
             os.path.join(data_root, env, 'original', 'pupariation.csv')):
@@ -2313,18 +2337,22 @@ def callback(well_idx, coef, time, midpoints, weight, style,
             {
                 # Manual evaluation time (vertical line)
                 'x': [manual_evals[well_idx], manual_evals[well_idx]],
-                'y': [0, larva_diffs.max()],
+                'y': [0, diffs_max],
                 'mode': 'lines',
                 'name': 'Manual',
                 'line': {'width': 2, 'color': '#ffa500'},
             },
         ]
 
+    # Points of the signal to draw, fine only in the shown range
+    xrange = relayout_xrange(layout)
+    xs, ys = signal_trace(larva_diffs, well_idx, xrange, pyramid)
+
     larva_data = [
             {
                 # Signal
-                'x': list(range(len(larva_diffs[0, :]))),
-                'y': list(larva_diffs[well_idx]),
+                'x': xs,
+                'y': ys,
                 'mode': 'lines',
                 'marker': {'color': '#4169e1'},
                 'name': 'Signal',
@@ -2342,7 +2370,7 @@ def callback(well_idx, coef, time, midpoints, weight, style,
             {
                 # Auto evaluation time (vertical line)
                 'x': [auto_evals[well_idx], auto_evals[well_idx]],
-                'y': [0, larva_diffs.max()],            
+                'y': [0, diffs_max],
                 'name': 'Auto',
                 'mode':'lines',
                 'line': {'width': 2, 'color': '#4169e1', 'dash': 'dot'},
@@ -2366,12 +2394,12 @@ def callback(well_idx, coef, time, midpoints, weight, style,
                 'annotations': [
                     {
                         'x': 0.01 * len(larva_diffs.T),
-                        'y': 1.0 * larva_diffs.max(),
+                        'y': 1.0 * diffs_max,
                         'text':
                             'Threshold: {:.1f}, Max: {:.1f}, Min: {:.1f}'  \
                                     .format(thresholds[well_idx, 0],
-                                            larva_diffs[well_idx].max(),
-                                            larva_diffs[well_idx].min()),
+                                            well_maxs[well_idx],
+                                            well_mins[well_idx]),
                         'showarrow': False,
                         'xanchor': 'left',
                         'yanchor': 'top',
@@ -2381,12 +2409,14 @@ def callback(well_idx, coef, time, midpoints, weight, style,
                 'xaxis': {
                     'title': 'Frame',
                     'tickfont': {'size': 15},
+                    'range': xrange,
+                    'autorange': xrange is None,
                 },
                 'yaxis': {
                     'title': 'Activity',
                     'tickfont': {'size': 15},
                     'overlaying': 'y',
-                    'range': [-0.1*larva_diffs.max(), larva_diffs.max()],
+                    'range': [-0.1*diffs_max, diffs_max],
 
                 },
                 'showlegend': False,
@@ -2444,7 +2474,8 @@ def callback(detect):
          Input('adult-window-size', 'value'),
          Input('adult-window-sigma', 'value'),
          Input('adult-signal-type', 'value'),
-         Input('detection-method', 'value')],
+         Input('detection-method', 'value'),
+         Input('adult-signal', 'relayoutData')],
         [State('well-selector', 'value'),
          State('data-root', 'children'),
          State('env-dropdown', 'value'),
@@ -2456,8 +2487,8 @@ def callback(detect):
 def callback(larva_coef, adult_coef, time, midpoints,
         larva_weighting, larva_w_style, larva_smoothing, larva_w_size,
         larva_w_sigma, adult_weighting, adult_w_style, adult_smoothing,
-        adult_w_size, adult_w_sigma, adult_signal_name, method, well_idx,
-        data_root, env, detect, larva, adult, timestamps,
+        adult_w_size, adult_w_sigma, adult_signal_name, method, layout,
+        well_idx, data_root, env, detect, larva, adult, timestamps,
         larva_signal_name):
     # Guard
     if env is None:
@@ -2477,40 +2508,43 @@ def callback(larva_coef, adult_coef, time, midpoints,
         pupar_times = None
 
     else:
-        # Load the data
-        larva_diffs = np.load(os.path.join(data_root,
-                env, 'inference', 'larva', larva, larva_signal_name)).T
-
-        larva_diffs = seasoning(
-                larva_diffs, 'larva', detect, larva_w_size, larva_w_sigma,
+        # Analyze the signals
+        _, __, pupar_times = analyze(
+                data_root, env, 'larva', larva, larva_signal_name, detect,
+                larva_w_size, larva_w_sigma,
                 smooth=len(larva_smoothing) != 0,
                 weight=len(larva_weighting) != 0,
-                pupar_times=None,
+                weight_style=larva_w_style,
                 midpoints=midpoints,
-                weight_style=larva_w_style)
-
-        larva_thresh = THRESH_FUNC(larva_diffs, coef=larva_coef)
-
-        pupar_times = detect_event(larva_diffs, larva_thresh, 'larva', detect, method)
+                coef=larva_coef,
+                method=method)
 
 
     # ----------------------------------------
     #  Detection of eclosion or death timing
     # ----------------------------------------
-    # Load the data
-    adult_diffs = np.load(os.path.join(
-            data_root, env, 'inference', 'adult', adult, adult_signal_name)).T
-    adult_diffs = seasoning(
-            adult_diffs, 'adult', detect, adult_w_size, adult_w_sigma,
+    # Analyze the signals
+    adult_diffs, adult_thresh, auto_evals = analyze(
+            data_root, env, 'adult', adult, adult_signal_name, detect,
+            adult_w_size, adult_w_sigma,
             smooth=len(adult_smoothing) != 0,
             weight=len(adult_weighting) != 0,
-            pupar_times=pupar_times,
+            weight_style=adult_w_style,
             midpoints=midpoints,
-            weight_style=adult_w_style)
-
-    adult_thresh = THRESH_FUNC(adult_diffs, coef=adult_coef)
-
-    auto_evals = detect_event(adult_diffs, adult_thresh, 'adult', detect, method)
+            coef=adult_coef,
+            method=method,
+            pupar_times=pupar_times)
+
+    # Min/max of the signals to draw, which also gives the extrema
+    pyramid = signal_pyramid(
+            data_root, env, 'adult', adult, adult_signal_name, detect,
+            adult_w_size, adult_w_sigma,
+            smooth=len(adult_smoothing) != 0,
+            weight=len(adult_weighting) != 0,
+            weight_style=adult_w_style,
+            midpoints=midpoints,
+            pupar_times=pupar_times)
+    diffs_max, well_maxs, well_mins = signal_extrema(adult_diffs, pyramid)
 
     # Load a manual evaluation of event timing
     if detect in ('eclosion', 'pupa-and-eclo') and os.path.exists(
@@ -2524,7 +2558,7 @@ def callback(larva_coef, adult_coef, time, midpoints,
             {
                 # Manual evaluation time (vertical line)
                 'x': [manual_evals[well_idx], manual_evals[well_idx]],
-                'y': [0, adult_diffs.max()],
+                'y': [0, diffs_max],
                 'mode': 'lines',
                 'name': 'Manual',
                 'line': {'width': 2, 'color': '#ffa500'},
@@ -2542,18 +2576,22 @@ def callback(larva_coef, adult_coef, time, midpoints,
             {
                 # Manual evaluation time (vertical line)
                 'x': [manual_evals[well_idx], manual_evals[well_idx]],
-                'y': [0, adult_diffs.max()],
+                'y': [0, diffs_max],
                 'mode': 'lines',
                 'name': 'Manual',
                 'line': {'width': 2, 'color': '#ffa500'},
             },
         ]
 
+    # Points of the signal to draw, fine only in the shown range
+    xrange = relayout_xrange(layout)
+    xs, ys = signal_trace(adult_diffs, well_idx, xrange, pyramid)
+
     adult_data = [
             {
                 # Signal
-                'x': list(range(len(adult_diffs[0, :]))),
-                'y': list(adult_diffs[well_idx]),
+                'x': xs,
+                'y': ys,
                 'mode': 'lines',
                 'marker': {'color': '#4169e1'},
                 'name': 'Signal',
@@ -2571,7 +2609,7 @@ def callback(larva_coef, adult_coef, time, midpoints,
             {
                 # Auto evaluation time (vertical line)
                 'x': [auto_evals[well_idx], auto_evals[well_idx]],
-                'y': [0, adult_diffs.max()],            
+                'y': [0, diffs_max],
                 'name': 'Auto',
                 'mode':'lines',
                 'line': {'width': 2, 'color': '#4169e1', 'dash': 'dot'},
@@ -2595,12 +2633,12 @@ def callback(larva_coef, adult_coef, time, midpoints,
                 'annotations': [
                     {
                         'x': 0.01 * len(adult_diffs.T),
-                        'y': 1.0 * adult_diffs.max(),
+                        'y': 1.0 * diffs_max,
                         'text':
                             'Threshold: {:.1f}, Max: {:.1f}, Min: {:.1f}'  \
                                     .format(adult_thresh[well_idx, 0],
-                                            adult_diffs[well_idx].max(),
-                                            adult_diffs[well_idx].min()),
+                                            well_maxs[well_idx],
+                                            well_mins[well_idx]),
                         'showarrow': False,
                         'xanchor': 'left',
                         'yanchor': 'top',
@@ -2610,12 +2648,14 @@ def callback(larva_coef, adult_coef, time, midpoints,
                 'xaxis': {
                     'title': 'Frame',
                     'tickfont': {'size': 15},
+                    'range': xrange,
+                    'autorange': xrange is None,
                 },
                 'yaxis': {
                     'title': 'Activity',
                     'tickfont': {'size': 15},
                     'side': 'left',
-                    'range': [-0.1*adult_diffs.max(), adult_diffs.max()],
+                    'range': [-0.1*diffs_max, diffs_max],
                 },
                 'showlegend': False,
                 'hovermode': 'closest',
@@ -2682,8 +2722,8 @@ def callback(coef, well_idx, midpoints, weight, style, checks, size, sigma,
         return {'data': []}
     if larva is None:
         return {'data': []}
-    if not os.path.exists(os.path.join(
-            data_root, env, 'inference', 'larva', larva, signal_name)):
+    if not os.path.exists(signal_path(
+            data_root, env, 'larva', larva, signal_name)):
         return {'data': []}
     if not os.path.exists(os.path.join(
             data_root, env, 'original', 'pupariation.csv')):
@@ -2720,21 +2760,16 @@ def callback(coef, well_idx, midpoints, weight, style, checks, size, sigma,
             os.path.join(data_root, env, 'original', 'pupariation.csv'),
             dtype=np.int32, delimiter=',').flatten()
 
-    # Load the data
-    larva_diffs = np.load(os.path.join(
-            data_root, env, 'inference', 'larva', larva, signal_name)).T
-
-    larva_diffs = seasoning(
-            larva_diffs, 'larva', detect, size, sigma,
+    # Analyze the signals
+    larva_diffs, thresholds, auto_evals = analyze(
+            data_root, env, 'larva', larva, signal_name, detect,
+            size, sigma,
             smooth=len(checks) != 0,
             weight=len(weight) != 0,
-            pupar_times=None,
+            weight_style=style,
             midpoints=midpoints,
-            weight_style=style)
-
-    thresholds = THRESH_FUNC(larva_diffs, coef=coef)
-
-    auto_evals = detect_event(larva_diffs, thresholds, 'larva', detect, method)
+            coef=coef,
+            method=method)
 
     # Calculate how many frames auto-evaluation is far from manual's one
     errors = auto_evals[targets] - manual_evals[targets]
@@ -2942,8 +2977,8 @@ def callback(larva_coef, adult_coef, well_idx, midpoints,
         return {'data': []}
     if adult is None:
         return {'data': []}
-    if not os.path.exists(os.path.join(
-            data_root, env, 'inference', 'adult', adult, adult_signal_name)):
+    if not os.path.exists(signal_path(
+            data_root, env, 'adult', adult, adult_signal_name)):
         return {'data': []}
     if not os.path.exists(os.path.join(
             data_root, env, 'original', 'eclosion.csv'))  \
@@ -3012,41 +3047,32 @@ def callback(larva_coef, adult_coef, well_idx, midpoints,
         pupar_times = None
 
     else:
-        # Load the data
-        larva_diffs = np.load(os.path.join(data_root,
-                env, 'inference', 'larva', larva, larva_signal_name)).T
-
-        larva_diffs = seasoning(
-                larva_diffs, 'larva', detect, larva_w_size, larva_w_sigma,
+        # Analyze the signals
+        _, __, pupar_times = analyze(
+                data_root, env, 'larva', larva, larva_signal_name, detect,
+                larva_w_size, larva_w_sigma,
                 smooth=len(larva_smoothing) != 0,
                 weight=len(larva_weighting) != 0,
-                pupar_times=None,
+                weight_style=larva_w_style,
                 midpoints=midpoints,
-                weight_style=larva_w_style)
-
-        larva_thresh = THRESH_FUNC(larva_diffs, coef=larva_coef)
-
-        pupar_times = detect_event(larva_diffs, larva_thresh, 'larva', detect, method)
+                coef=larva_coef,
+                method=method)
 
 
     # ----------------------------------------
     #  Detection of eclosion or death timing
     # ----------------------------------------
-    # Load the data
-    adult_diffs = np.load(os.path.join(
-            data_root, env, 'inference', 'adult', adult, adult_signal_name)).T
-
-    adult_diffs = seasoning(
-            adult_diffs, 'adult', detect, adult_w_size, adult_w_sigma,
+    # Analyze the signals
+    adult_diffs, adult_thresh, auto_evals = analyze(
+            data_root, env, 'adult', adult, adult_signal_name, detect,
+            adult_w_size, adult_w_sigma,
             smooth=len(adult_smoothing) != 0,
             weight=len(adult_weighting) != 0,
-            pupar_times=pupar_times,
+            weight_style=adult_w_style,
             midpoints=midpoints,
-            weight_style=adult_w_style)
-
-    adult_thresh = THRESH_FUNC(adult_diffs, coef=adult_coef)
-
-    auto_evals = detect_event(adult_diffs, adult_thresh, 'adult', detect, method)
+            coef=adult_coef,
+            method=method,
+            pupar_times=pupar_times)
 
     # Calculate how many frames auto-evaluation is far from manual's one
     errors = auto_evals[targets] - manual_evals[targets]
@@ -3245,8 +3271,8 @@ def callback(coef, well_idx, midpoints, weight, style, checks, size, sigma,
         return {'data': []}
     if larva is None:
         return {'data': []}
-    if not os.path.exists(os.path.join(
-            data_root, env, 'inference', 'larva', larva, signal_name)):
+    if not os.path.exists(signal_path(
+            data_root, env, 'larva', larva, signal_name)):
         return {'data': []}
     if not os.path.exists(os.path.join(
             data_root, env, 'original', 'pupariation.csv')):
@@ -3274,21 +3300,16 @@ def callback(coef, well_idx, midpoints, weight, style, checks, size, sigma,
     exceptions = np.logical_or(blacklist['value'], manual_evals == 0)
     targets = np.logical_not(exceptions)
 
-    # Load the data
-    larva_diffs = np.load(os.path.join(
-            data_root, env, 'inference', 'larva', larva, signal_name)).T
-
-    larva_diffs = seasoning(
-            larva_diffs, 'larva', detect, size, sigma,
+    # Analyze the signals
+    larva_diffs, thresholds, auto_evals = analyze(
+            data_root, env, 'larva', larva, signal_name, detect,
+            size, sigma,
             smooth=len(checks) != 0,
             weight=len(weight) != 0,
-            pupar_times=None,
+            weight_style=style,
             midpoints=midpoints,
-            weight_style=style)
-
-    thresholds = THRESH_FUNC(larva_diffs, coef=coef)
-
-    auto_evals = detect_event(larva_diffs, thresholds, 'larva', detect, method)
+            coef=coef,
+            method=method)
 
     # Calculate how many frames auto-evaluation is far from manual's one
     errors = auto_evals - manual_evals
@@ -3448,8 +3469,8 @@ def callback(larva_coef, adult_coef, well_idx, midpoints,
         return {'data': []}
     if adult is None:
         return {'data': []}
-    if not os.path.exists(os.path.join(
-            data_root, env, 'inference', 'adult', adult, adult_signal_name)):
+    if not os.path.exists(signal_path(
+            data_root, env, 'adult', adult, adult_signal_name)):
         return {'data': []}
 
     # Load a manual evaluation of event timing
@@ -3509,41 +3530,32 @@ def callback(larva_coef, adult_coef, well_idx, midpoints,
         pupar_times = None
 
     else:
-        # Load the data
-        larva_diffs = np.load(os.path.join(data_root,
-                env, 'inference', 'larva', larva, larva_signal_name)).T
-
-        larva_diffs = seasoning(
-                larva_diffs, 'larva', detect, larva_w_size, larva_w_sigma,
+        # Analyze the signals
+        _, __, pupar_times = analyze(
+                data_root, env, 'larva', larva, larva_signal_name, detect,
+                larva_w_size, larva_w_sigma,
                 smooth=len(larva_smoothing) != 0,
                 weight=len(larva_weighting) != 0,
-                pupar_times=None,
+                weight_style=larva_w_style,
                 midpoints=midpoints,
-                weight_style=larva_w_style)
-
-        larva_thresh = THRESH_FUNC(larva_diffs, coef=larva_coef)
-
-        pupar_times = detect_event(larva_diffs, larva_thresh, 'larva', detect, method)
+                coef=larva_coef,
+                method=method)
 
 
     # ----------------------------------------
     #  Detection of eclosion or death timing
     # ----------------------------------------
-    # Load the data
-    adult_diffs = np.load(os.path.join(
-            data_root, env, 'inference', 'adult', adult, adult_signal_name)).T
-
-    adult_diffs = seasoning(
-            adult_diffs, 'adult', detect, adult_w_size, adult_w_sigma,
+    # Analyze the signals
+    adult_diffs, adult_thresh, auto_evals = analyze(
+            data_root, env, 'adult', adult, adult_signal_name, detect,
+            adult_w_size, adult_w_sigma,
             smooth=len(adult_smoothing) != 0,
             weight=len(adult_weighting) != 0,
-            pupar_times=pupar_times,
+            weight_style=adult_w_style,
             midpoints=midpoints,
-            weight_style=adult_w_style)
-
-    adult_thresh = THRESH_FUNC(adult_diffs, coef=adult_coef)
-
-    auto_evals = detect_event(adult_diffs, adult_thresh, 'adult', detect, method)
+            coef=adult_coef,
+            method=method,
+            pupar_times=pupar_times)
 
     # Calculate how many frames auto-evaluation is far from manual's one
     errors = auto_evals - manual_evals
@@ -3694,11 +3706,11 @@ def callback(larva_coef, adult_coef, well_idx, midpoints, larva_weighting,
         return {'data': []}
     if adult is None:
         return {'data': []}
-    if not os.path.exists(os.path.join(
-            data_root, env, 'inference', 'larva', larva, larva_signal_name)):
+    if not os.path.exists(signal_path(
+            data_root, env, 'larva', larva, larva_signal_name)):
         return {'data': []}
-    if not os.path.exists(os.path.join(
-            data_root, env, 'inference', 'adult', adult, adult_signal_name)):
+    if not os.path.exists(signal_path(
+            data_root, env, 'adult', adult, adult_signal_name)):
         return {'data': []}
     if detect == 'death':
         return {'data': []}
@@ -3708,37 +3720,28 @@ def callback(larva_coef, adult_coef, well_idx, midpoints, larva_weighting,
     whitelist = np.logical_not(blacklist)
 
     # Evaluation of pupariation timings
-    larva_diffs = np.load(os.path.join(
-            data_root, env, 'inference', 'larva', larva, larva_signal_name)).T
-
-    larva_diffs = seasoning(
-            larva_diffs, 'larva', detect, larva_w_size, larva_w_sigma,
+    larva_diffs, larva_thresh, pupar_times = analyze(
+            data_root, env, 'larva', larva, larva_signal_name, detect,
+            larva_w_size, larva_w_sigma,
             smooth=len(larva_smoothing) != 0,
             weight=len(larva_weighting) != 0,
-            pupar_times=None,
+            weight_style=larva_w_style,
             midpoints=midpoints,
-            weight_style=larva_w_style)
-
-    larva_thresh = THRESH_FUNC(larva_diffs, coef=larva_coef)
-
-    pupar_times = detect_event(larva_diffs, larva_thresh, 'larva', detect, method)
+            coef=larva_coef,
+            method=method)
 
 
     # Evaluation of eclosion timings
-    adult_diffs = np.load(os.path.join(
-            data_root, env, 'inference', 'adult', adult, adult_signal_name)).T
-
-    adult_diffs = seasoning(
-            adult_diffs, 'adult', detect, adult_w_size, adult_w_sigma,
+    adult_diffs, adult_thresh, eclo_times = analyze(
+            data_root, env, 'adult', adult, adult_signal_name, detect,
+            adult_w_size, adult_w_sigma,
             smooth=len(adult_smoothing) != 0,
             weight=len(adult_weighting) != 0,
-            pupar_times=pupar_times,
+            weight_style=adult_w_style,
             midpoints=midpoints,
-            weight_style=adult_w_style)
-
-    adult_thresh = THRESH_FUNC(adult_diffs, coef=adult_coef)
-
-    eclo_times = detect_event(adult_diffs, adult_thresh, 'adult', detect, method)
+            coef=adult_coef,
+            method=method,
+            pupar_times=pupar_times)
 
     return {
             'data': [
@@ -3836,8 +3839,8 @@ def callback(coef, well_idx, midpoints, weight, style, checks, size, sigma,
         return {'data': []}
     if adult is None:
         return {'data': []}
-    if not os.path.exists(os.path.join(
-            data_root, env, 'inference', 'adult', adult, signal_name)):
+    if not os.path.exists(signal_path(
+            data_root, env, 'adult', adult, signal_name)):
         return {'data': []}
     if detect in ('pupariation', 'eclosion', 'pupa-and-eclo'):
         return {'data': []}
@@ -3848,68 +3851,47 @@ def callback(coef, well_idx, midpoints, weight, style, checks, size, sigma,
     # Load a group table
     group_tables = load_grouping_csv(data_root, env)
 
-    # Load the data
-    adult_diffs = np.load(os.path.join(
-            data_root, env, 'inference', 'adult', adult, signal_name)).T
-
-    adult_diffs = seasoning(
-            adult_diffs, 'adult', detect, size, sigma,
+    # Analyze the signals
+    adult_diffs, thresholds, auto_evals = analyze(
+            data_root, env, 'adult', adult, signal_name, detect,
+            size, sigma,
             smooth=len(checks) != 0,
             weight=len(weight) != 0,
-            pupar_times=None,
+            weight_style=style,
             midpoints=midpoints,
-            weight_style=style)
-
-    thresholds = THRESH_FUNC(adult_diffs, coef=coef)
-
-    auto_evals = detect_event(adult_diffs, thresholds, 'adult', detect, method)
+            coef=coef,
+            method=method)
 
     if group_tables == []:
         # Compute survival ratio of all the animals
-        survival_ratio = np.zeros_like(adult_diffs)
-
-        for well_idx, event_time in enumerate(auto_evals):
+        survival_ratio = survival_ratios(
+                auto_evals, adult_diffs.shape[1],
+                [np.ones(len(auto_evals), dtype=bool)], whitelist)[0]
 
-            survival_ratio[well_idx, :event_time] = 1
-
-        survival_ratio =  \
-                100 * survival_ratio[whitelist].sum(axis=0) /  \
-                len(survival_ratio[whitelist])
+        idxs = decimate(survival_ratio)
 
         data_list = [
             {
-                'x': list(range(len(survival_ratio))),
-                'y': list(survival_ratio),
+                'x': idxs.tolist(),
+                'y': survival_ratio[idxs].tolist(),
                 'mode': 'lines',
                 'line': {'size': 2, 'color': '#ff4500'},
                 'name': 'Group1'
             }]
 
     else:
-        survival_ratios = []
-        for group_idx, group_table in enumerate(group_tables):
-
-            survival_ratio = np.zeros_like(adult_diffs)
-
-            for well_idx, (event_time, in_group)  \
-                    in enumerate(zip(auto_evals, group_table)):
-
-                survival_ratio[well_idx, :event_time] = in_group
+        # Compute survival ratios of all the groups at once
+        ratios = survival_ratios(
+                auto_evals, adult_diffs.shape[1], group_tables, whitelist)
 
-            survival_ratio =  \
-                    100 * survival_ratio[whitelist].sum(axis=0) /  \
-                    group_table[whitelist].sum()
-
-            survival_ratios.append(survival_ratio)
-    
         data_list =[]
-        for group_idx, (group_table, survival_ratio)  \
-                in enumerate(zip(group_tables, survival_ratios)):
+        for group_idx, survival_ratio in enumerate(ratios):
+            idxs = decimate(survival_ratio)
 
             data_list.append(
                 {
-                    'x': list(range(len(survival_ratio))),
-                    'y': list(survival_ratio),
+                    'x': idxs.tolist(),
+                    'y': survival_ratio[idxs].tolist(),
                     'mode': 'lines',
                     'marker': {'size': 2, 'color': GROUP_COLORS[group_idx]},
                     'name': 'Group{}'.format(group_idx + 1),
@@ -3989,8 +3971,8 @@ def callback(coef, well_idx, midpoints, weight, style, checks, size, sigma,
         return {'data': []}
     if larva is None:
         return {'data': []}
-    if not os.path.exists(os.path.join(
-            data_root, env, 'inference', 'larva', larva, signal_name)):
+    if not os.path.exists(signal_path(
+            data_root, env, 'larva', larva, signal_name)):
         return {'data': []}
     if detect == 'death':
         return {'data': []}
@@ -4001,22 +3983,16 @@ def callback(coef, well_idx, midpoints, weight, style, checks, size, sigma,
     # Load a group table
     group_tables = load_grouping_csv(data_root, env)
 
-    # Load the data
-    larva_diffs = np.load(os.path.join(
-            data_root, env, 'inference', 'larva', larva, signal_name)).T
-
-    larva_diffs = seasoning(
-            larva_diffs, 'larva', detect, size, sigma,
+    # Analyze the signals
+    larva_diffs, thresholds, auto_evals = analyze(
+            data_root, env, 'larva', larva, signal_name, detect,
+            size, sigma,
             smooth=len(checks) != 0,
             weight=len(weight) != 0,
-            pupar_times=None,
+            weight_style=style,
             midpoints=midpoints,
-            weight_style=style)
-
-    # Compute thresholds
-    thresholds = THRESH_FUNC(larva_diffs, coef=coef)
-
-    auto_evals = detect_event(larva_diffs, thresholds, 'larva', detect, method)
+            coef=coef,
+            method=method)
 
     # Make data to be drawn
     if group_tables == []:
@@ -4128,8 +4104,8 @@ def callback(larva_coef, adult_coef, well_idx, midpoints,
         return {'data': []}
     if adult is None:
         return {'data': []}
-    if not os.path.exists(os.path.join(
-            data_root, env, 'inference', 'adult', adult, adult_signal_name)):
+    if not os.path.exists(signal_path(
+            data_root, env, 'adult', adult, adult_signal_name)):
         return {'data': []}
     if detect == 'pupariation':
         return {'data': []}
@@ -4148,41 +4124,32 @@ def callback(larva_coef, adult_coef, well_idx, midpoints,
         pupar_times = None
 
     else:
-        # Load the data
-        larva_diffs = np.load(os.path.join(data_root,
-                env, 'inference', 'larva', larva, larva_signal_name)).T
-
-        larva_diffs = seasoning(
-                larva_diffs, 'larva', detect, larva_w_size, larva_w_sigma,
+        # Analyze the signals
+        _, __, pupar_times = analyze(
+                data_root, env, 'larva', larva, larva_signal_name, detect,
+                larva_w_size, larva_w_sigma,
                 smooth=len(larva_smoothing) != 0,
                 weight=len(larva_weighting) != 0,
-                pupar_times=None,
+                weight_style=larva_w_style,
                 midpoints=midpoints,
-                weight_style=larva_w_style)
-
-        larva_thresh = THRESH_FUNC(larva_diffs, coef=larva_coef)
-
-        pupar_times = detect_event(larva_diffs, larva_thresh, 'larva', detect, method)
+                coef=larva_coef,
+                method=method)
 
 
     # ----------------------------------------
     #  Detection of eclosion or death timing
     # ----------------------------------------
-    # Load the data
-    adult_diffs = np.load(os.path.join(
-            data_root, env, 'inference', 'adult', adult, adult_signal_name)).T
-
-    adult_diffs = seasoning(
-            adult_diffs, 'adult', detect, adult_w_size, adult_w_sigma,
+    # Analyze the signals
+    adult_diffs, adult_thresh, auto_evals = analyze(
+            data_root, env, 'adult', adult, adult_signal_name, detect,
+            adult_w_size, adult_w_sigma,
             smooth=len(adult_smoothing) != 0,
             weight=len(adult_weighting) != 0,
-            pupar_times=pupar_times,
+            weight_style=adult_w_style,
             midpoints=midpoints,
-            weight_style=adult_w_style)
-
-    adult_thresh = THRESH_FUNC(adult_diffs, coef=adult_coef)
-
-    auto_evals = detect_event(adult_diffs, adult_thresh, 'adult', detect, method)
+            coef=adult_coef,
+            method=method,
+            pupar_times=pupar_times)
 
     # Make data to be drawn
     if group_tables == []:
@@ -4268,18 +4235,94 @@ def callback(env, data_root):
     if env is None:
         return
 
-    # Load an original image
-    orgimg_paths = sorted(glob.glob(os.path.join(
-            data_root, glob.escape(env), 'original', '*.jpg')))
+    image_names, create_times = load_timestamps(data_root, env)
 
     return {
-            'Image name': [os.path.basename(path) for path in orgimg_paths],
-            'Create time': [get_create_time(path) for path in orgimg_paths],
+            'Image name': image_names,
+            'Create time': create_times,
         }
 
 
+def load_timestamps(data_root, env):
+    '''
+    Image names and timestamps of the frames of a dataset.
+
+    The timestamps are kept in timestamps.csv in the dataset directory
+    with the mtime and size of each frame. Only the frames which are not
+    found in it, or whose mtime or size differs, are read (in parallel),
+    and then the file is updated.
+    '''
+    orgimg_paths = CATALOG.frames(data_root, env)
+    image_names = [os.path.basename(path) for path in orgimg_paths]
+
+    sidecar_path = os.path.join(data_root, env, 'timestamps.csv')
+    columns = ['Image name', 'Create time', 'Mtime', 'Size']
+
+    known = {}
+    if os.path.exists(sidecar_path):
+        sidecar = pd.read_csv(sidecar_path, dtype=str)
+
+        # Files of the former format without the mtime and size are read
+        # again
+        if all(column in sidecar.columns for column in columns):
+            known = {
+                    name: (create_time, (mtime, size))
+                    for name, create_time, mtime, size in zip(
+                        *[sidecar[column] for column in columns])}
+
+    with concurrent.futures.ThreadPoolExecutor(
+            max_workers=TIMESTAMP_WORKERS) as executor:
+        stats = [
+                (str(stat.st_mtime_ns), str(stat.st_size))
+                for stat in executor.map(os.stat, orgimg_paths)]
+
+        new_idxs = [
+                idx for idx, (name, stat) in enumerate(zip(image_names, stats))
+                if name not in known or known[name][1] != stat]
+
+        new_times = executor.map(
+                get_create_time, [orgimg_paths[idx] for idx in new_idxs])
+
+        for idx, create_time in zip(new_idxs, new_times):
+            known[image_names[idx]] = (create_time, stats[idx])
+
+    create_times = [known[name][0] for name in image_names]
+
+    # Update the sidecar when frames are added, replaced or removed
+    if len(new_idxs) > 0 or len(known) != len(image_names):
+        sidecar = pd.DataFrame(
+                {'Image name': image_names, 'Create time': create_times,
+                    'Mtime': [mtime for mtime, _ in stats],
+                    'Size': [size for _, size in stats]},
+                columns=columns)
+
+        # Write to a temporary file first not to leave a broken one
+        tmp_path = '{}.{}.tmp'.format(sidecar_path, threading.get_ident())
+        try:
+            sidecar.to_csv(tmp_path, index=False)
+            os.replace(tmp_path, sidecar_path)
+
+        except OSError:
+            # The dataset directory may be read-only
+            pass
+
+    return image_names, create_times
+
+
 def get_create_time(path):
-    DateTimeDigitized = PIL.Image.open(path)._getexif()[36868]
+    # Only the head of the file is parsed, where EXIF is stored
+    with open(path, 'rb') as f:
+        header = f.read(EXIF_HEADER_SIZE)
+
+    try:
+        exif = PIL.Image.open(io.BytesIO(header))._getexif()
+
+    except OSError:
+        # Headers longer than EXIF_HEADER_SIZE
+        with PIL.Image.open(path) as image:
+            exif = image._getexif()
+
+    DateTimeDigitized = exif[36868]
     # '2016:02:05 17:20:53' -> '2016-02-05 17:20:53'
     DateTimeDigitized = DateTimeDigitized[:4] + '-' + DateTimeDigitized[5:]
     DateTimeDigitized = DateTimeDigitized[:7] + '-' + DateTimeDigitized[8:]
@@ -4390,19 +4433,15 @@ def make_auto_table(data_root, env, morph, target_dir, detect, signal_name, para
     if target_dir is None:
         return html.Div(style={'display': 'inline-block'})
 
-    signals = np.load(os.path.join(
-            data_root, env, 'inference', morph, target_dir, signal_name)).T
-    signals = seasoning(
-            signals, morph, detect, w_size, w_sigma,
+    _, __, auto_evals = analyze(
+            data_root, env, morph, target_dir, signal_name, detect,
+            w_size, w_sigma,
             smooth=len(smoothing) != 0,
             weight=len(weighting) != 0,
-            pupar_times=None,
+            weight_style=w_style,
             midpoints=midpoints,
-            weight_style=w_style)
-
-    thresh = THRESH_FUNC(signals, coef=coef)
-
-    auto_evals = detect_event(signals, thresh, morph, detect, method)
+            coef=coef,
+            method=method)
     auto_evals = auto_evals.reshape(
             params['n-rows']*params['n-plates'], params['n-clms'])
 
@@ -4580,340 +4619,160 @@ def get_cell_style(params, auto_evals):
     ]
 
 
-def seasoning(signals, signal_type, detect, size, sigma, smooth, weight,
-        pupar_times, midpoints=None, weight_style=None):
-
-    # Smooth the signals
-    if smooth:
-        signals = my_filter(signals, size=size, sigma=sigma)
-
-    else:
-        pass
-
-    # Apply weight to the signals
-    if weight:
-
-        # Detection of pupariation
-        if detect == 'pupariation' and signal_type == 'larva':
+def split_signal_name(signal_name):
+    '''
+    File name and theta of a signal type. The signals at a threshold theta
+    of the family made by make_theta_signals.py are named e.g.
+    'signals_theta.npy:40', and the others are the file names.
+    '''
+    if signal_name.startswith(my_labels.THETA_SIGNALS + ':'):
+        file_name, theta = signal_name.rsplit(':', 1)
+        return file_name, int(theta)
 
-            # Step or ramp weight
-            if weight_style == 'step':
-                for well_idx, midpoint in enumerate(midpoints['midpoint']):
-                    signals[well_idx, midpoint:] = 0
+    return signal_name, None
 
-            elif weight_style == 'ramp':
-                # Ramp filter
-                for well_idx, midpoint in enumerate(midpoints['midpoint']):
-                    signals[well_idx] = signals[well_idx] *  \
-                            (-1 / midpoint * np.arange(len(signals.T)) + 1)
-            else:
-                pass
 
-        # Not defined
-        elif detect == 'pupariation' and signal_type == 'adult':
-            pass
-
-        # Not defined
-        elif detect == 'eclosion' and signal_type == 'larva':
-            pass
-
-        # Detection of eclosion
-        elif detect == 'eclosion' and signal_type == 'adult':
-            # Step or ramp weight
-            if weight_style == 'step':
-                for well_idx, midpoint in enumerate(midpoints['midpoint']):
-                    signals[well_idx, :midpoint] = 0
-
-            elif weight_style == 'ramp':
-                # Ramp filter
-                for well_idx, midpoint in enumerate(midpoints['midpoint']):
-                    signals[well_idx] = signals[well_idx] * (
-                            1 / (len(signals.T) - midpoint)
-                            * np.arange(len(signals.T))
-                            - midpoint / (len(signals.T) - midpoint))
-            else:
-                pass
-
-        # Detection of pupariation
-        elif detect == 'pupa-and-eclo' and signal_type == 'larva':
-
-            # Step or ramp weight
-            if weight_style == 'step':
-                for well_idx, midpoint in enumerate(midpoints['midpoint']):
-                    signals[well_idx, midpoint:] = 0
-
-            elif weight_style == 'ramp':
-                # Ramp filter
-                for well_idx, midpoint in enumerate(midpoints['midpoint']):
-                    signals[well_idx] = signals[well_idx] *  \
-                            (-1 / midpoint * np.arange(len(signals.T)) + 1)
-
-            else:
-                pass
-
-        # Detection of eclosion
-        elif detect == 'pupa-and-eclo' and signal_type == 'adult':
-            """
-            if pupar_times is not None:
-                mask = -np.ones_like(signals, dtype=float)
-
-                for i, event_timing in enumerate(pupar_times):
-                    '''
-                    # Step filter
-                    mask[i, event_timing:] = 1
-                    '''
-                    # Ramp filter
-                    lin_weight = np.linspace(
-                            0, 1, len(signals.T) - event_timing)
-
-                    mask[i, event_timing:] = lin_weight
-
-                signals = signals * mask
-
-            else:
-                # Ramp filter
-                signals = signals *  \
-                        (np.arange(len(signals.T)) / len(signals.T))
-            """
-
-            # Step or ramp weight
-            if weight_style == 'step':
-                for well_idx, midpoint in enumerate(midpoints['midpoint']):
-                    signals[well_idx, :midpoint] = 0
-
-            elif weight_style == 'ramp':
-                # Ramp filter
-                for well_idx, midpoint in enumerate(midpoints['midpoint']):
-                    signals[well_idx] = signals[well_idx] * (
-                            1 / (len(signals.T) - midpoint)
-                            * np.arange(len(signals.T))
-                            - midpoint / (len(signals.T) - midpoint))
-            else:
-                pass
-
-        # Not defined
-        elif detect == 'death' and signal_type == 'larva':
-            pass
-
-        # Detection of death
-        elif detect == 'death' and signal_type == 'adult':
-
-            # Step or ramp weight
-            if weight_style == 'step':
-                for well_idx, midpoint in enumerate(midpoints['midpoint']):
-                    signals[well_idx, midpoint:] = 0
-
-            elif weight_style == 'ramp':
-                # Ramp filter
-                for well_idx, midpoint in enumerate(midpoints['midpoint']):
-                    signals[well_idx] = signals[well_idx] *  \
-                            (-1 / midpoint * np.arange(len(signals.T)) + 1)
-
-            else:
-                pass
+def signal_path(data_root, dataset_name, morph, target_dir, signal_name):
+    # Path to the file of a signal type
+    return os.path.join(
+            data_root, dataset_name, 'inference', morph, target_dir,
+            split_signal_name(signal_name)[0])
 
-    else:
-        pass
 
-    return signals
+def signal_options(data_root, dataset_name, morph, target_dir):
+    # Signal files and the signals at each theta if they are made
+    options = [{'label': i, 'value': i} for i in CATALOG.signal_files(
+            data_root, dataset_name, morph, target_dir)]
 
+    if os.path.exists(os.path.join(
+            data_root, dataset_name, 'inference', morph, target_dir,
+            my_labels.THETA_SIGNALS)):
 
-def max_amplitude(signals):
-    amplitudes = []
-    for signal in signals:
-        if signal.sum() == 0:
-            amplitudes.append(0)
-        else:
-            amplitudes.append(signal.max() - signal[signal > 0].min())
-    return np.argmax(amplitudes), np.max(amplitudes)
+        options += [
+                {'label': 'theta = {}'.format(theta),
+                 'value': '{}:{}'.format(my_labels.THETA_SIGNALS, theta)}
+                for theta in range(1, my_labels.N_THETAS)]
 
+    return options
 
-def calc_threshold(signal, coef=0.5):
-    max = signal.max()
-    min = signal.min()
-    return min + coef * (max - min)
 
-
-def find_rising_up_and_falling_down(signal, thresh):
-    # シグナルに閾値処理をして二値化する
-    icebergs = (signal > thresh).astype(int)
-    
-    # 二値化されたシグナルから立ち上がりと立ち下がりのインデックスを探す
-    diff = np.diff(icebergs)
-    rising_up_idxs = np.where(diff == 1)[0] + 1
-    falling_down_idxs = np.where(diff == -1)[0] + 1
-    
-    # 例外処理
-    # 始めから立ち上がっていた場合、0 を立ち上がりインデックスとして挿入する
-    if icebergs[0] == 1:
-        rising_up_idxs = np.concatenate([np.array([0]), rising_up_idxs])
-        
-    # 最後が立ち上がりのまま終わっていた場合、
-    # シグナルの最終インデックスを立ち下がりインデックスとして挿入する
-    if icebergs[-1] == 1:
-        falling_down_idxs = np.concatenate([falling_down_idxs, np.array([len(icebergs) - 1])])
-    
-    # 立ち上がりと立ち下がりの数は必ず同数になる
-    assert len(rising_up_idxs) == len(falling_down_idxs)
-    
-    return rising_up_idxs, falling_down_idxs
+def load_signals(data_root, dataset_name, morph, target_dir, signal_name):
+    # Well-major (n_wells, n_frames) read-only signals shared by callbacks
+    return SIGNAL_CACHE.load(
+            signal_path(
+                data_root, dataset_name, morph, target_dir, signal_name),
+            split_signal_name(signal_name)[1])
 
 
-def relmax_by_thresh(signal, thresh):
-    # 閾値を切ったシグナルに対して、立ち上がりと立ち下がりを探す
-    rising_up_idxs, falling_down_idxs = find_rising_up_and_falling_down(signal, thresh)
-    
-    # 極大値の計算
-    relmax_args = scipy.signal.argrelmax(signal, order=3)[0]
-    relmax_values = signal[relmax_args]
-    
-    candidate_args = []
-    for rising_up_idx, falling_down_idx in zip(rising_up_idxs, falling_down_idxs):
-        args = []
-        values = []
-        for relmax_arg, relmax_value in zip(relmax_args, relmax_values):
-            if relmax_arg in range(rising_up_idx, falling_down_idx):
-                args.append(relmax_arg)
-                values.append(relmax_value)
-        assert len(args) == len(values)
-        if len(args) == 0:
-            if rising_up_idx == falling_down_idx:
-                candidate_args.append(rising_up_idx)
-            else:
-                candidate_args.append(rising_up_idx + np.argmax(signal[rising_up_idx:falling_down_idx]))
-        elif len(args) == 1:
-            candidate_args.append(args[0])
-        elif len(args) >= 2:
-            candidate_args.append(args[np.argmax(values)])
-    
-    candidate_args = np.array(candidate_args)
-    
-    return relmax_args, candidate_args
+def load_pyramid(data_root, dataset_name, morph, target_dir, signal_name):
+    # Min/max pyramid of the raw signals, built once into a sidecar
+    if split_signal_name(signal_name)[1] is not None:
+        # Not for the signals at each theta
+        return None
 
+    path = signal_path(
+            data_root, dataset_name, morph, target_dir, signal_name)
+    return ANALYSIS_CACHE.get_or_load(
+            ('pyramid', my_cache.file_key(path)),
+            lambda: my_pyramid.load_pyramid(path))
 
-def exception_event(detect, signal_type, exception_value):
-    if detect == 'pupariation' and signal_type == 'larva':
-        auto_eval = 0
 
-    elif detect == 'pupariation' and signal_type == 'adult':
-        # Never evaluated
-        raise Exception
+def load_bounding_boxes(data_root, dataset_name):
+    # (n_wells, 4) bounding boxes of the wells shared by callbacks
+    path = os.path.join(data_root, dataset_name, 'mask.npy')
+    return ANALYSIS_CACHE.get_or_load(
+            ('boxes', my_cache.file_key(path)),
+            lambda: my_mask.load_bounding_boxes(
+                os.path.join(data_root, dataset_name)))
 
-    elif detect == 'eclosion' and signal_type == 'larva':
-        # Never evaluated
-        raise Exception
 
-    elif detect == 'eclosion' and signal_type == 'adult':
-        auto_eval = 0
+def load_n_wells(data_root, dataset_name):
+    # Number of the wells given by mask_params.json
+    path = os.path.join(data_root, dataset_name, 'mask_params.json')
 
-    elif detect == 'pupa-and-eclo' and signal_type == 'larva':
-        auto_eval = 0
+    def load():
+        with open(path) as f:
+            params = json.load(f)
 
-    elif detect == 'pupa-and-eclo' and signal_type == 'adult':
-        auto_eval = 0
+        return params['n-rows'] * params['n-plates'] * params['n-clms']
 
-    elif detect == 'death' and signal_type == 'larva':
-        # Never evaluated
-        raise Exception
+    return ANALYSIS_CACHE.get_or_load(
+            ('n_wells', my_cache.file_key(path)), load, nbytes=0)
 
-    elif detect == 'death' and signal_type == 'adult':
-        auto_eval = exception_value
 
-    return auto_eval
+def load_probs(data_root, dataset_name, morph, target_dir, well_idx, times):
+    '''
+    Probability maps of a well only at the given frames.
 
+    Chunked files are read chunk by chunk. Files holding the whole series
+    in one member are decompressed once and kept in ANALYSIS_CACHE, so
+    the images of the neighboring frames do not decompress them again.
+    '''
+    probs_path = os.path.join(
+            data_root, dataset_name, 'inference', morph, target_dir,
+            'probs', '{:03d}.npz'.format(well_idx))
 
-def detect_event(signals, thresholds, signal_type, detect, method):
-    n_wells, length = signals.shape
+    if my_probs.is_chunked(probs_path):
+        return my_probs.load_frames(probs_path, times)
 
-    if method == 'relmax':
-        auto_evals = []
-        for signal in signals:
+    def load():
+        probs = my_probs.load_all(probs_path)
+        probs.setflags(write=False)
+        return probs
 
-            if np.all(signal == signal[0]):
-                auto_eval = exception_event(detect, signal_type, length)
+    probs = ANALYSIS_CACHE.get_or_load(
+            ('probs', my_cache.file_key(probs_path)), load)
 
-            else:
-                thresh = calc_threshold(signal, 0.5)
-                relmax_args, candidate_args = relmax_by_thresh(signal, thresh)
-                candidate_values = signal[candidate_args]
+    return probs[list(times)]
 
-                if len(candidate_args) == 0:
-                    auto_eval = exception_event(detect, signal_type, length)
 
-                elif len(candidate_args) == 1:
-                    auto_eval = candidate_args[0]
+def load_labels(data_root, dataset_name, morph, target_dir):
+    # Memory-mapped (n_wells, n_frames, 392) packed labels or None
+    labels_path = os.path.join(
+            data_root, dataset_name, 'inference', morph, target_dir,
+            'labels.npy')
+    if not os.path.exists(labels_path):
+        return None
 
-                else:
-                    normed = candidate_values / candidate_values.sum()
+    return ANALYSIS_CACHE.get_or_load(
+            ('labels', my_cache.file_key(labels_path)),
+            lambda: np.load(labels_path, mmap_mode='r'),
+            nbytes=0)
 
-                    if normed.max() >= 0.5:
-                        auto_eval = candidate_args[np.argmax(candidate_values)]
 
-                    else:
-                        auto_eval = exception_event(detect, signal_type, length)
+def load_well_image(data_root, dataset_name, well_idx, time):
+    # Load the bounding box of the well
+    box = load_bounding_boxes(data_root, dataset_name)[well_idx]
 
-            auto_evals.append(auto_eval)
+    # Load the well image pre-cropped by make_tiles.py if it exists
+    tiles = load_tiles(data_root, dataset_name)
 
-        auto_evals = np.array(auto_evals, dtype=int)
+    if tiles is not None and time < tiles.shape[1]:
+        return my_tiles.get_tile(tiles, box, well_idx, time)
 
-    elif method == 'max':
-        auto_evals = []
-        for signal in signals:
-            if np.all(signal == signal[0]):
-                auto_eval = exception_event(detect, signal_type, length)
+    # Load an original image
+    orgimg_path = CATALOG.frames(data_root, dataset_name)[time]
+    with PIL.Image.open(orgimg_path) as image:
+        orgimg = np.array(image.convert('L'), dtype=np.uint8)
 
-            else:
-                auto_eval = signal.argmax()
+    # Cut out an well image from the original image
+    return my_mask.crop(orgimg, box)
 
-            auto_evals.append(auto_eval)
 
-        auto_evals = np.array(auto_evals, dtype=int)
+def load_tiles(data_root, dataset_name):
+    # Memory-mapped (n_wells, n_frames, height, width) well images or None
+    tiles_path = os.path.join(data_root, dataset_name, 'tiles.npy')
+    mask_path = os.path.join(data_root, dataset_name, 'mask.npy')
+    if not os.path.exists(tiles_path) or not os.path.exists(mask_path):
+        return None
 
-    elif method == 'thresholding':
-        if detect == 'pupariation' and signal_type == 'larva':
-            # Detect the falling of the signal
-            # Scan the signal from the right hand side.
-            auto_evals = \
-                    length - (np.fliplr(signals) > thresholds).argmax(axis=1)
-            # If the signal was not more than the threshold.
-            auto_evals[auto_evals == length] = 0
-
-        elif detect == 'pupariation' and signal_type == 'adult':
-            # Never evaluated
-            raise Exception
-
-        elif detect == 'eclosion' and signal_type == 'larva':
-            # Never evaluated
-            raise Exception
-
-        elif detect == 'eclosion' and signal_type == 'adult':
-            # Detect the rising of the signal
-            # Compute event times from signals
-            auto_evals = (signals > thresholds).argmax(axis=1)
-
-        elif detect == 'pupa-and-eclo' and signal_type == 'larva':
-            # Detect the falling of the signal
-            # Scan the signal from the right hand side.
-            auto_evals = \
-                    length - (np.fliplr(signals) > thresholds).argmax(axis=1)
-            # If the signal was not more than the threshold.
-            auto_evals[auto_evals == length] = 0
-
-        elif detect == 'pupa-and-eclo' and signal_type == 'adult':
-            # Detect the rising of the signal
-            # Compute event times from signals
-            auto_evals = (signals > thresholds).argmax(axis=1)
-
-        elif detect == 'death' and signal_type == 'larva':
-            # Never evaluated
-            raise Exception
-
-        elif detect == 'death' and signal_type == 'adult':
-            # Scan the signal from the right hand side.
-            auto_evals = \
-                    length - (np.fliplr(signals) > thresholds).argmax(axis=1)
-
-    return auto_evals
+    # A memory map holds no data in memory, so it costs nothing in the cache
+    return ANALYSIS_CACHE.get_or_load(
+            ('tiles', my_cache.file_key(tiles_path),
+                my_cache.file_key(mask_path)),
+            lambda: my_tiles.load_tiles(
+                os.path.join(data_root, dataset_name)),
+            nbytes=0)
 
 
 def load_blacklist(data_root, dataset_name, white=False):
@@ -4943,6 +4802,133 @@ def load_blacklist(data_root, dataset_name, white=False):
         return blacklist, exist
 
 
+def relayout_xrange(layout):
+    '''
+    Range of x shown in a figure zoomed by a user, or None if not zoomed.
+    '''
+    if layout is None or layout.get('xaxis.autorange'):
+        return None
+
+    if 'xaxis.range[0]' in layout:
+        return [layout['xaxis.range[0]'], layout['xaxis.range[1]']]
+
+    elif 'xaxis.range' in layout:
+        return list(layout['xaxis.range'])
+
+    else:
+        return None
+
+
+def decimate(signal, xrange=None, n_buckets=TRACE_BUCKETS):
+    '''
+    Indices of the points of a signal to draw.
+
+    The signal is divided into n_buckets buckets, and only the min and
+    max of each bucket are drawn, which looks the same as the full
+    signal at the width of a figure. When zoomed into xrange, the range
+    and its neighbors of the same width (for panning) are divided into
+    n_buckets instead, so that the signal is drawn at full resolution
+    once the range is narrower than n_buckets frames.
+    '''
+    length = len(signal)
+    if length == 0:
+        return np.arange(0)
+
+    overview = envelope(signal, 0, length, -(-length // n_buckets))
+
+    if xrange is None:
+        return np.union1d(overview, [0, length - 1])
+
+    lo = int(np.clip(np.floor(xrange[0]), 0, length))
+    hi = int(np.clip(np.ceil(xrange[1]) + 1, 0, length))
+    width = hi - lo
+
+    if width <= 0:
+        return np.union1d(overview, [0, length - 1])
+
+    start = max(lo - width, 0)
+    stop = min(hi + width, length)
+    detail = envelope(signal, start, stop, -(-width // n_buckets))
+
+    return np.union1d(
+            np.union1d(overview[(overview < start) | (overview >= stop)],
+                detail),
+            [0, length - 1])
+
+
+def signal_trace(signals, well_idx, xrange=None, pyramid=None):
+    '''
+    Points (x, y) of the signal of a well to draw.
+
+    The min/max of the buckets are read from the pyramid of the signals
+    if given, otherwise they are found in the signal by decimate().
+    '''
+    if pyramid is not None:
+        xs, ys = my_pyramid.trace(
+                pyramid, signals[well_idx], well_idx, xrange, TRACE_BUCKETS)
+        return xs.tolist(), ys.tolist()
+
+    idxs = decimate(signals[well_idx], xrange)
+    return idxs.tolist(), signals[well_idx, idxs].tolist()
+
+
+def envelope(signal, start, stop, bucket):
+    '''
+    Indices of the min and max in each bucket of frames in [start, stop).
+    '''
+    if bucket <= 1:
+        return np.arange(start, stop)
+
+    n_buckets = -(-(stop - start) // bucket)
+
+    # Fill the last bucket with the last value
+    blocks = np.empty(n_buckets * bucket, dtype=signal.dtype)
+    blocks[:stop-start] = signal[start:stop]
+    blocks[stop-start:] = signal[stop-1]
+    blocks = blocks.reshape(n_buckets, bucket)
+
+    offsets = start + bucket * np.arange(n_buckets)
+    idxs = np.concatenate([
+            offsets + blocks.argmin(axis=1),
+            offsets + blocks.argmax(axis=1)])
+
+    return np.minimum(idxs, stop - 1)
+
+
+def survival_ratios(event_times, length, group_tables, whitelist):
+    '''
+    Survival ratios [%] of the groups at each frame. An animal is alive
+    before its event time. The animals alive at each frame are counted
+    by a reversed cumulative sum of the event times counted per group,
+    without making a (n_wells, n_frames) matrix.
+
+    Input
+    -----
+    event_times : ndarray (n_wells,)
+    length : int, the number of frames
+    group_tables : list of boolean ndarrays (n_wells,)
+    whitelist : boolean ndarray (n_wells,)
+
+    Output
+    ------
+    ratios : ndarray (n_groups, length)
+    '''
+    event_times = np.clip(np.asarray(event_times, dtype=int), 0, length)
+    tables = np.logical_and(np.array(group_tables, dtype=bool), whitelist)
+    n_groups = len(tables)
+
+    # Count the event times of the animals in each group
+    groups, wells = np.nonzero(tables)
+    counts = np.bincount(
+            groups * (length + 1) + event_times[wells],
+            minlength=n_groups * (length + 1)).reshape(n_groups, length + 1)
+
+    # The animals whose event times are later than each frame
+    alive = np.cumsum(counts[:, ::-1], axis=1)[:, ::-1][:, 1:]
+
+    return 100 * alive / tables.sum(axis=1, keepdims=True)
+
+
 def load_grouping_csv(data_root, dataset_name):
 
     if os.path.exists(os.path.join(data_root, dataset_name, 'grouping.csv')):
@@ -5004,28 +4990,38 @@ def day_and_night(timestamps):
 # =====================
 @app.callback(
         Output('org-img', 'figure'),
-        [Input('tabs', 'value')],
+        [Input('tabs', 'value'),
+         Input('org-img', 'relayoutData')],
         [State('data-root', 'children'),
          State('env-dropdown', 'value')])
-def update_images_div(table_name, data_root, dataset_name):
+def update_images_div(table_name, layout, data_root, dataset_name):
     # Guard
     if data_root is None or dataset_name is None:
         return {'data': [], 'layout': {}}
     if table_name != 'tab-3':
         raise dash.exceptions.PreventUpdate
 
-    # Load an original image
-    original_image_paths = sorted(glob.glob(os.path.join(
-            data_root, glob.escape(dataset_name), 'original', '*.jpg')))
-    original_image = PIL.Image.open(original_image_paths[0]).convert('L')
+    # Size of an original image (only the header is read)
+    original_image_paths = CATALOG.frames(data_root, dataset_name)
+    with PIL.Image.open(original_image_paths[0]) as image:
+        width, height = image.size
 
-    # Buffer the well image as byte stream
-    buf = io.BytesIO()
-    original_image.save(buf, format='JPEG')
-    data_uri = 'data:image/jpeg;base64,{}'.format(
-            base64.b64encode(buf.getvalue()).decode('utf-8'))
+    # Keep the zoomed range
+    if layout is not None and 'xaxis.range[0]' in layout:
+        xrange = (layout['xaxis.range[0]'], layout['xaxis.range[1]'])
+    else:
+        xrange = (0, width)
 
-    height, width = np.array(original_image).shape
+    if layout is not None and 'yaxis.range[0]' in layout:
+        yrange = (layout['yaxis.range[0]'], layout['yaxis.range[1]'])
+    else:
+        yrange = (0, height)
+
+    # URL of a preview as fine as the zoomed range on the figure,
+    # so the full resolution is decoded only when zoomed in
+    orgimg_url = image_url(
+            data_root, 'frame', dataset_name, 0,
+            level=preview_level(xrange[1] - xrange[0], 400))
 
     return {
             'data': [go.Scatter(x=[0], y=[0], mode='lines+markers')],
@@ -5034,12 +5030,12 @@ def update_images_div(table_name, data_root, dataset_name):
                 'height': 700,
                 'margin': go.layout.Margin(l=40, b=40, t=26, r=10),
                 'xaxis': {
-                    'range': (0, width),
+                    'range': xrange,
                     'scaleanchor': 'y',
                     'scaleratio': 1,
                 },
                 'yaxis': {
-                    'range': (0, height),
+                    'range': yrange,
                 },
                 'images': [{
                     'xref': 'x',
@@ -5050,7 +5046,7 @@ def update_images_div(table_name, data_root, dataset_name):
                     'sizing': 'stretch',
                     'sizex': width,
                     'sizey': height,
-                    'source': data_uri,
+                    'source': orgimg_url,
                 }],
                 'dragmode': 'select',
             }
@@ -5112,22 +5108,19 @@ def update_well_h(selected_data):
          Input('well_h', 'value'),
          Input('angle', 'value')],
         [State('org-img', 'figure'),
-         State('mask-img', 'relayoutData')])
+         State('mask-img', 'relayoutData'),
+         State('data-root', 'children')])
 def draw_images(
         n_rows, n_clms, n_plates,
         gap_r, gap_c, gap_p, x, y, well_w, well_h, angle,
-        figure, layout):
+        figure, layout, data_root):
 
     # Guard
     if 'images' not in figure['layout']:
         return {'data': [], 'layout': {}}
 
-    # Get base64ed hash of original image
-    orgimg_uri = figure['layout']['images'][0]['source']
-    imghash = orgimg_uri.split(',')[1]
-
-    # Transform hash to ndarray
-    org_img = np.array(PIL.Image.open(io.BytesIO(base64.b64decode(imghash))))
+    # Load the original image in the figure
+    org_img = load_figure_image(data_root, figure)
 
     # Create a mask
     mask = create_mask(
@@ -5204,22 +5197,19 @@ def draw_images(
          Input('well_h', 'value'),
          Input('angle', 'value')],
         [State('org-img', 'figure'),
-         State('masked-img', 'relayoutData')])
+         State('masked-img', 'relayoutData'),
+         State('data-root', 'children')])
 def draw_images(
         n_rows, n_clms, n_plates,
         gap_r, gap_c, gap_p, x, y, well_w, well_h, angle,
-        figure, layout):
+        figure, layout, data_root):
 
     # Guard
     if 'images' not in figure['layout']:
         return {'data': [], 'layout': {}}
 
-    # Get base64ed hash of original image
-    orgimg_uri = figure['layout']['images'][0]['source']
-    imghash = orgimg_uri.split(',')[1]
-
-    # Transform hash to ndarray
-    org_img = np.array(PIL.Image.open(io.BytesIO(base64.b64decode(imghash))))
+    # Load the original image in the figure
+    org_img = load_figure_image(data_root, figure)
 
     # Create a mask
     mask = create_mask(
@@ -5306,12 +5296,11 @@ def create_mask(
                 mask[r1:r2, c1:c2] = well_idxs[count]
                 count += 1
 
-    shapes = []
-    for well_idx in np.unique(mask)[1:]:
-        clms, rows = np.where(mask == well_idx)
-        masked = mask[min(clms):max(clms), min(rows):max(rows)]
-        shapes.append(masked.shape)
-    shapes = np.array(shapes)
+    # Shapes of the well images cut out by the bounding boxes
+    boxes = my_mask.bounding_boxes(mask)
+    boxes = boxes[boxes[:, 0] >= 0]
+    shapes = np.array(
+            [boxes[:, 1] - boxes[:, 0], boxes[:, 3] - boxes[:, 2]]).T
 
     if np.unique(shapes.T[0]).shape[0] >= 2 \
             or np.unique(shapes.T[1]).shape[0] >= 2:
@@ -5388,7 +5377,8 @@ def draw_images(submit_n_clicks, data_root, dataset_name,
 
     out_dir = os.path.join(data_root, dataset_name)
     save_mask_file(out_dir, n_rows, n_clms, n_plates,
-            gap_r, gap_c, gap_p, x, y, well_w, well_h, angle, figure)
+            gap_r, gap_c, gap_p, x, y, well_w, well_h, angle,
+            load_figure_image(data_root, figure))
 
     return 'Saved!'
 
@@ -5405,14 +5395,7 @@ def callback(message):
 
 
 def save_mask_file(out_dir, n_rows, n_clms, n_plates,
-        gap_r, gap_c, gap_p, x, y, well_w, well_h, angle, figure):
-
-    # Get base64ed hash of original image
-    orgimg_uri = figure['layout']['images'][0]['source']
-    imghash = orgimg_uri.split(',')[1]
-
-    # Transform hash to ndarray
-    org_img = np.array(PIL.Image.open(io.BytesIO(base64.b64decode(imghash))))
+        gap_r, gap_c, gap_p, x, y, well_w, well_h, angle, org_img):
 
     # Make a mask
     mask = create_mask(
@@ -5435,6 +5418,9 @@ def save_mask_file(out_dir, n_rows, n_clms, n_plates,
         # save the mask
         np.save(os.path.join(out_dir, 'mask.npy'), mask.astype(np.int16))
 
+    # save the bounding boxes of the wells
+    my_mask.save_bounding_boxes(out_dir, mask.astype(np.int16))
+
     # Parameters
     params_dict = {
             'n-rows': n_rows,
@@ -5466,5 +5452,260 @@ def save_mask_file(out_dir, n_rows, n_clms, n_plates,
             json.dump(params_dict, f, indent=4)
 
 
+# ================
+#  Image server
+# ================
+# Callbacks give the browser URLs of images instead of base64 data, so
+# that the browser caches the images and the responses stay small.
+#
+#   /images/frame?dataset=&t=[&level=]               An original image
+#   /images/well?dataset=&t=&well=                   A well image
+#   /images/prob?dataset=&t=&well=&morph=&profile=   A prob image
+#   /images/label?dataset=&t=&well=&morph=&profile=  A label image
+#
+# The URLs have a version "v" made from the mtimes of the source files,
+# so a URL never points to an outdated image and can be cached long.
+#
+# Label images are unpacked from labels.npy made by inference.py, or
+# made from the prob images of older results.
+#
+# Original images are previewed at 1/2**level of their size, which the
+# JPEG decoder produces directly (draft mode). Each level of a frame is
+# cached separately in IMAGE_CACHE.
+IMAGE_KINDS = ('frame', 'well', 'prob', 'label')
+
+
+def image_url(data_root, kind, dataset_name, time, well_idx=None,
+        morph=None, target_dir=None, level=0):
+    params = image_params(
+            data_root, kind, dataset_name, time, well_idx, morph, target_dir,
+            level)
+    params['v'] = image_version(data_root, kind, params)
+
+    return '/images/{}?{}'.format(kind, urllib.parse.urlencode(params))
+
+
+def image_params(data_root, kind, dataset_name, time, well_idx=None,
+        morph=None, target_dir=None, level=0):
+    '''
+    Query arguments of an image, which raises ValueError for a dataset,
+    network or profile not under data_root, so that a request never reads
+    files outside of it, and for a frame or well out of range.
+    '''
+    if dataset_name not in CATALOG.datasets(data_root):
+        raise ValueError('Unknown dataset: {}'.format(dataset_name))
+
+    params = {'dataset': dataset_name, 't': int(time)}
+
+    if not 0 <= params['t'] < CATALOG.n_frames(data_root, dataset_name):
+        raise ValueError('Frame out of range: {}'.format(time))
+
+    if kind == 'frame' and int(level) > 0:
+        params['level'] = min(int(level), MAX_PREVIEW_LEVEL)
+
+    if kind in ('well', 'prob', 'label'):
+        params['well'] = int(well_idx)
+
+        if not 0 <= params['well'] < load_n_wells(data_root, dataset_name):
+            raise ValueError('Well out of range: {}'.format(well_idx))
+
+    if kind in ('prob', 'label'):
+        if morph not in ('larva', 'adult') or target_dir not in  \
+                CATALOG.profiles(data_root, dataset_name, morph):
+            raise ValueError('Unknown profile: {}/{}'.format(
+                morph, target_dir))
+
+        params['morph'] = morph
+        params['profile'] = target_dir
+
+    return params
+
+
+def image_sources(data_root, kind, params):
+    # Files from which an image is made
+    if kind == 'frame':
+        return [CATALOG.frames(data_root, params['dataset'])[params['t']]]
+
+    elif kind == 'well':
+        return [CATALOG.frames(data_root, params['dataset'])[params['t']],
+                os.path.join(data_root, params['dataset'], 'mask.npy')]
+
+    out_dir = os.path.join(
+            data_root, params['dataset'], 'inference', params['morph'],
+            params['profile'])
+
+    labels_path = os.path.join(out_dir, 'labels.npy')
+    if kind == 'label' and os.path.exists(labels_path):
+        return [labels_path]
+
+    else:
+        return [os.path.join(
+                out_dir, 'probs', '{:03d}.npz'.format(params['well']))]
+
+
+def image_version(data_root, kind, params):
+    sources = [my_cache.file_key(path)
+            for path in image_sources(data_root, kind, params)]
+
+    # The labelling rule is a part of the version of the label images
+    key = repr((kind, sorted(params.items()), sources,
+            'probs >= {}'.format(my_labels.THETA)))
+
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+
+def preview_level(image_width, display_width):
+    '''
+    The coarsest level of preview which is still wider than the display.
+    '''
+    if display_width <= 0 or image_width <= display_width:
+        return 0
+
+    level = int(np.floor(np.log2(image_width / display_width)))
+
+    return min(level, MAX_PREVIEW_LEVEL)
+
+
+def render_image(data_root, kind, params):
+    if kind == 'frame':
+        with PIL.Image.open(image_sources(data_root, kind, params)[0])  \
+                as image:
+
+            level = params.get('level', 0)
+            if level > 0:
+                size = (max(image.size[0] >> level, 1),
+                        max(image.size[1] >> level, 1))
+
+                # Decode at a reduced scale in the DCT domain (JPEG only)
+                image.draft('L', size)
+
+                if image.size != size:
+                    return image.resize(size, PIL.Image.BILINEAR).convert('L')
+
+            return image.convert('L')
+
+    elif kind == 'well':
+        return PIL.Image.fromarray(load_well_image(
+                data_root, params['dataset'], params['well'], params['t']))
+
+    if kind == 'label':
+        labels = load_labels(
+                data_root, params['dataset'], params['morph'],
+                params['profile'])
+
+        # Unpack the labels saved by inference.py if any
+        if labels is not None:
+            return PIL.Image.fromarray(my_labels.unpack(
+                labels[params['well'], params['t']]).astype(np.uint8) * 255)
+
+    probs = load_probs(
+            data_root, params['dataset'], params['morph'], params['profile'],
+            params['well'], [params['t']])[0]
+
+    if kind == 'prob':
+        return PIL.Image.fromarray(probs / 100 * 255).convert('L')
+
+    else:
+        return PIL.Image.fromarray(
+                my_labels.threshold(probs).astype(np.uint8) * 255)
+
+
+def encode_jpeg(image):
+    buf = io.BytesIO()
+    image.save(buf, format='JPEG')
+
+    return buf.getvalue()
+
+
+@app.server.route('/images/<kind>')
+def serve_image(kind):
+    args = flask.request.args
+
+    if kind not in IMAGE_KINDS:
+        flask.abort(404)
+
+    try:
+        params = image_params(
+                DATA_ROOT, kind, args['dataset'], args['t'], args.get('well'),
+                args.get('morph'), args.get('profile'), args.get('level', 0))
+        version = image_version(DATA_ROOT, kind, params)
+
+    except (KeyError, ValueError, TypeError, IndexError, OSError):
+        flask.abort(404)
+
+    # The browser already has the image
+    if version in flask.request.if_none_match:
+        response = flask.make_response('', 304)
+
+    else:
+        response = flask.make_response(IMAGE_CACHE.get_or_load(
+                version,
+                lambda: render_jpeg(DATA_ROOT, kind, params)))
+        response.mimetype = 'image/jpeg'
+
+    # Images of the same well are likely to be requested next
+    if kind in ('well', 'prob', 'label'):
+        prefetch_images(DATA_ROOT, kind, params)
+
+    response.set_etag(version)
+    response.cache_control.public = True
+    response.cache_control.max_age = IMAGE_MAX_AGE
+
+    return response
+
+
+def prefetch_images(data_root, kind, params):
+    '''
+    Load the images of the frames around params['t'] into IMAGE_CACHE in
+    the background, nearer frames first.
+    '''
+    n_frames = CATALOG.n_frames(data_root, params['dataset'])
+
+    for offset in range(1, PREFETCH_FRAMES + 1):
+        for time in (params['t'] + offset, params['t'] - offset):
+            if not 0 <= time < n_frames:
+                continue
+
+            neighbor = dict(params, t=time)
+
+            try:
+                version = image_version(data_root, kind, neighbor)
+
+            except OSError:
+                continue
+
+            IMAGE_PREFETCHER.submit(
+                    version,
+                    functools.partial(
+                        render_jpeg, data_root, kind, neighbor))
+
+
+def render_jpeg(data_root, kind, params):
+    return encode_jpeg(render_image(data_root, kind, params))
+
+
+def load_figure_image(data_root, figure):
+    '''
+    Load the image shown in a figure as an ndarray (height, width), which
+    is given as either a URL of the image server or a base64 data URI.
+    A preview is loaded at the original size.
+    '''
+    source = figure['layout']['images'][0]['source']
+
+    if source.startswith('data:'):
+        imghash = source.split(',')[1]
+        return np.array(PIL.Image.open(io.BytesIO(base64.b64decode(imghash))))
+
+    url = urllib.parse.urlparse(source)
+    kind = url.path.split('/')[-1]
+    args = dict(urllib.parse.parse_qsl(url.query))
+
+    params = image_params(
+            data_root, kind, args['dataset'], args['t'], args.get('well'),
+            args.get('morph'), args.get('profile'))
+
+    return np.array(render_image(data_root, kind, params))
+
+
 if __name__ == '__main__':
     app.run_server(debug=False, dev_tools_props_check=False)